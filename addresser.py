@@ -1,3 +1,13 @@
+import threading
+from collections import OrderedDict
+
+# Most geometries we cache addressers for
+ADDRESSER_CACHE_SIZE = 32
+
+# Largest container for which an addresser keeps its address tables in memory
+MAX_TABULATED_SIZE = 16384
+
+
 def index_to_address_part(index, alpha):
     """Return the row/column part of an address using the given index (from zero),
     either 0->"A", 1->"B" or 0->"1", 1->"2", ...
@@ -101,3 +111,60 @@ class Addresser(object):
         return 'Addresser(num_rows=%s, num_cols=%s, row_is_alpha=%s, col_is_alpha=%s)' % (
                self.num_rows, self.num_cols, self.row_is_alpha, self.col_is_alpha
         )
+
+
+class TabulatedAddresser(Addresser):
+    """Addresser which precomputes every address of its geometry, so that conversions
+    are lookups in a tuple or a dict."""
+
+    def __init__(self, num_rows, num_cols, row_is_alpha, col_is_alpha, separator=':'):
+        super(TabulatedAddresser, self).__init__(num_rows, num_cols, row_is_alpha, col_is_alpha,
+                                                 separator)
+        self._addresses = tuple(Addresser.index_to_address(self, i) for i in xrange(len(self)))
+        self._indexes = {address: i for i, address in enumerate(self._addresses)}
+
+    def index_to_address(self, index):
+        """Convert the given index to an address."""
+        if not 0 <= index < len(self):
+            raise IndexError("Index out of address range: %s", index)
+        return self._addresses[index]
+
+    __getitem__ = index_to_address
+
+    def __iter__(self):
+        return iter(self._addresses)
+
+    def __contains__(self, address):
+        """Is the given address valid for this addresser?"""
+        return address in self._indexes
+
+    def index(self, address):
+        """Convert the given address (a string) to a 0-based index.
+        Raises a ValueError if the address cannot be converted."""
+        try:
+            return self._indexes[address]
+        except (KeyError, TypeError):
+            # Let the calculation report what is wrong with the address
+            return super(TabulatedAddresser, self).index(address)
+
+
+_addressers = OrderedDict()
+_addressers_lock = threading.Lock()
+
+
+def get_addresser(num_rows, num_cols, row_is_alpha, col_is_alpha, separator=':'):
+    """Return an addresser for the given geometry, shared with other callers asking for the
+    same geometry. The most recently used addressers are kept, up to ADDRESSER_CACHE_SIZE.
+    """
+    key = (num_rows, num_cols, bool(row_is_alpha), bool(col_is_alpha), separator)
+    with _addressers_lock:
+        addresser = _addressers.pop(key, None)
+        if addresser is None:
+            if num_rows*num_cols <= MAX_TABULATED_SIZE:
+                addresser = TabulatedAddresser(*key)
+            else:
+                addresser = Addresser(*key)
+            if len(_addressers) >= ADDRESSER_CACHE_SIZE:
+                _addressers.popitem(last=False)
+        _addressers[key] = addresser
+        return addresser
@@ -0,0 +1,58 @@
+import os
+import threading
+
+from pymongo import ReturnDocument
+
+BARCODE_PREFIX = 'AKER-'
+
+
+class BarcodeAllocator(object):
+    """Hands out sequence numbers for AKER barcodes from the counters collection.
+
+    Each call to the database reserves a whole range with a single $inc. If block_size
+    is set, the allocator also reserves at least that many numbers at a time and keeps
+    the unused ones for later requests in this process. Numbers left in a block when a
+    worker stops are never used, so the sequence may contain gaps.
+    """
+
+    def __init__(self, block_size=0, counter_id='barcode'):
+        self.block_size = max(int(block_size or 0), 0)
+        self.counter_id = counter_id
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def reserve(self, counters, count):
+        """Reserve count consecutive numbers with one update and return them as a list."""
+        if count <= 0:
+            return []
+        result = counters.find_one_and_update(
+            {'_id': self.counter_id},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        last = result['seq']
+        return range(last-count+1, last+1)
+
+    def allocate(self, counters, count):
+        """Return a list of count unused sequence numbers."""
+        if not self.block_size:
+            return self.reserve(counters, count)
+        with self._lock:
+            if self._pid != os.getpid():
+                # A block inherited from a parent process is shared with every sibling
+                # worker, so it must not be used
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            numbers = range(self._next, min(self._next+count, self._end))
+            self._next += len(numbers)
+            missing = count - len(numbers)
+            if missing:
+                block = self.reserve(counters, max(missing, self.block_size))
+                numbers.extend(block[:missing])
+                self._next, self._end = block[0]+missing, block[-1]+1
+            return numbers
+
+    def barcodes(self, counters, count):
+        """Return a list of count new AKER barcodes."""
+        return ['%s%s' % (BARCODE_PREFIX, n) for n in self.allocate(counters, count)]
@@ -0,0 +1,49 @@
+"""Micro-benchmarks for the service. Each module can be run on its own, e.g.
+
+    python -m benchmarks.barcode_benchmark
+
+Benchmarks that need a database use a scratch database on the MongoDB server
+configured in db/development.py, which is dropped afterwards.
+"""
+import timeit
+
+from pymongo import MongoClient
+
+import db.development
+from db.development import MONGO_HOST, MONGO_PORT
+
+BENCHMARK_DBNAME = 'materials_benchmark'
+
+
+def benchmark_db():
+    """Return a handle on the (empty) benchmark database."""
+    client = MongoClient(MONGO_HOST, MONGO_PORT)
+    client.drop_database(BENCHMARK_DBNAME)
+    return client[BENCHMARK_DBNAME]
+
+
+def benchmark_app(**settings):
+    """Return the service app using the benchmark database, with the given settings changed."""
+    from run import create_app
+    config = {k: v for k, v in vars(db.development).iteritems() if k.isupper()}
+    config['MONGO_DBNAME'] = BENCHMARK_DBNAME
+    config.update(settings)
+    return create_app(config)
+
+
+def drop_benchmark_db(db):
+    db.client.drop_database(BENCHMARK_DBNAME)
+
+
+def best_time(func, repeat=3, number=1):
+    """Return the best wall-clock time in seconds of calling func number times."""
+    return min(timeit.repeat(func, repeat=repeat, number=number))
+
+
+def report(title, rows, headers):
+    """Print a simple fixed-width table of results."""
+    print title
+    widths = [max(len(str(x)) for x in column) for column in zip(headers, *rows)]
+    for row in [headers] + list(rows):
+        print '  '.join(str(x).rjust(w) for x, w in zip(row, widths))
+    print
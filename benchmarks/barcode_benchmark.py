@@ -0,0 +1,39 @@
+"""Compare barcode throughput when allocating one counter update per container,
+one update per request, and from a per-worker reserved block."""
+from pymongo import ReturnDocument
+
+from barcodes import BarcodeAllocator
+from benchmarks import benchmark_db, drop_benchmark_db, best_time, report
+
+BATCH_SIZES = [1, 10, 100, 500, 2000]
+
+
+def one_update_per_container(counters, count):
+    for _ in xrange(count):
+        counters.find_one_and_update({'_id': 'barcode'}, {'$inc': {'seq': 1}},
+                                     return_document=ReturnDocument.AFTER)
+
+
+def main():
+    db = benchmark_db()
+    counters = db.counters
+    counters.insert({'_id': 'barcode', 'seq': 0})
+    per_request = BarcodeAllocator()
+    per_block = BarcodeAllocator(block_size=1000)
+    rows = []
+    try:
+        for size in BATCH_SIZES:
+            times = [
+                best_time(lambda: one_update_per_container(counters, size)),
+                best_time(lambda: per_request.allocate(counters, size)),
+                best_time(lambda: per_block.allocate(counters, size)),
+            ]
+            rows.append([size] + ['%.0f' % (size / t) for t in times])
+    finally:
+        drop_benchmark_db(db)
+    report('Barcodes allocated per second', rows,
+           ['batch', 'per container', 'per request', 'block of 1000'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Time looking up the locations of materials in a collection of 100k containers, with and
+without the multikey index on slots.material."""
+import uuid
+
+from slots import find_material_locations
+from benchmarks import benchmark_db, drop_benchmark_db, best_time, report
+
+NUM_CONTAINERS = 100000
+FILLED_SLOTS = 12
+LOOKUP_SIZES = [1, 100, 1000]
+
+
+def containers(count):
+    for n in xrange(count):
+        yield {
+            '_id': str(uuid.uuid4()),
+            'barcode': 'AKER-%s' % n,
+            'num_of_rows': 8, 'num_of_cols': 12, 'row_is_alpha': True, 'col_is_alpha': False,
+            'slots': [{'address': 'A:%s' % (i+1), 'material': str(uuid.uuid4())}
+                      for i in xrange(FILLED_SLOTS)],
+        }
+
+
+def main():
+    db = benchmark_db()
+    rows = []
+    try:
+        batch = []
+        for container in containers(NUM_CONTAINERS):
+            batch.append(container)
+            if len(batch) == 1000:
+                db.containers.insert_many(batch)
+                batch = []
+        materials = [doc['slots'][0]['material']
+                     for doc in db.containers.aggregate([{'$sample': {'size': max(LOOKUP_SIZES)}}])]
+
+        timings = {}
+        for indexed in (False, True):
+            if indexed:
+                db.containers.create_index('slots.material')
+            for size in LOOKUP_SIZES:
+                timings[size, indexed] = best_time(
+                    lambda: find_material_locations(db.containers, materials[:size]))
+        for size in LOOKUP_SIZES:
+            rows.append([size, '%.1f' % (timings[size, False]*1000), '%.1f' % (timings[size, True]*1000)])
+    finally:
+        drop_benchmark_db(db)
+    report('Material location lookup time (ms) over %s containers' % NUM_CONTAINERS, rows,
+           ['materials', 'no index', 'slots.material index'])
+
+
+if __name__ == '__main__':
+    main()
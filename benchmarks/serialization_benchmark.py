@@ -0,0 +1,71 @@
+"""Compare serialising a page of search results by converting each document's dates and
+strings and then dumping it with bson's json_util, with the single-pass serialiser, for
+each JSON backend that is installed."""
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from bson import json_util
+from eve.default_settings import DATE_FORMAT
+
+from benchmarks import best_time, report
+from serialization import JSON_BACKENDS, make_dumps
+
+PAGE_SIZES = [1000, 10000]
+
+
+def material(i):
+    created = datetime(2017, 1, 1) + timedelta(minutes=i)
+    return {
+        u'_id': unicode(uuid.uuid4()),
+        u'supplier_name': u'Supplier name %d' % i,
+        u'donor_id': u'Donor %d' % (i % 100),
+        u'gender': u'female',
+        u'phenotype': u'Phenotype',
+        u'scientific_name': u'Homo sapiens',
+        u'available': bool(i % 2),
+        u'owner_id': u'owner%d@sanger.ac.uk' % (i % 10),
+        u'date_of_receipt': created,
+        u'parents': [unicode(uuid.uuid4())],
+        u'_created': created,
+        u'_updated': created,
+        u'_etag': u'%032x' % i,
+    }
+
+
+def two_pass(msg):
+    for item in msg['_items']:
+        for k, v in item.iteritems():
+            if isinstance(v, datetime):
+                item[k] = v.strftime(DATE_FORMAT)
+            if isinstance(v, unicode):
+                item[k] = str(v)
+    return json.dumps(msg, default=json_util.default)
+
+
+def main():
+    backends = []
+    for name in sorted(JSON_BACKENDS):
+        try:
+            backends.append((name, make_dumps(DATE_FORMAT, name)))
+        except ValueError:
+            pass
+    rows = []
+    for size in PAGE_SIZES:
+        def page():
+            return {'_items': [material(i) for i in xrange(size)], '_meta': {'max_results': size}}
+
+        # The two-pass version changes the documents, so each run gets a fresh page
+        pages = [page() for _ in xrange(3)]
+        baseline = best_time(lambda: two_pass(pages.pop()))
+        msg = page()
+        for name, dumps in backends:
+            single = best_time(lambda: dumps(msg))
+            rows.append([size, name, '%.1f' % (baseline*1000), '%.1f' % (single*1000),
+                         '%.1fx' % (baseline/single)])
+    report('Search page serialisation time (ms)', rows,
+           ['documents', 'backend', 'two pass', 'single pass', 'speed-up'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Compare validating container slots in a single pass with validating each slot with
+its Cerberus schema, for plates of increasing size."""
+import uuid
+
+from flask import current_app
+
+from addresser import get_addresser
+from benchmarks import benchmark_db, benchmark_app, drop_benchmark_db, best_time, report
+
+GEOMETRIES = [(8, 12), (16, 24), (32, 48)]
+
+
+def container(num_rows, num_cols, materials=None):
+    row_is_alpha = num_rows <= 26
+    slots = [{'address': address} for address in get_addresser(num_rows, num_cols, row_is_alpha, False)]
+    if materials:
+        for slot, material in zip(slots, materials):
+            slot['material'] = material
+    return {'num_of_rows': num_rows, 'num_of_cols': num_cols, 'row_is_alpha': row_is_alpha,
+            'col_is_alpha': False, 'slots': slots}
+
+
+def validation_time(app, document, fast):
+    app.config['FAST_SLOT_VALIDATION'] = fast
+    schema = app.config['DOMAIN']['containers']['schema']
+
+    def validate():
+        validator = app.validator(schema, resource='containers')
+        assert validator.validate(document), validator.errors
+    return best_time(validate, number=5) / 5
+
+
+def main():
+    db = benchmark_db()
+    app = benchmark_app()
+    rows = []
+    try:
+        with app.test_request_context():
+            materials = [str(uuid.uuid4()) for _ in xrange(max(r*c for r, c in GEOMETRIES))]
+            current_app.data.driver.db.materials.insert([{'_id': m} for m in materials])
+            for num_rows, num_cols in GEOMETRIES:
+                for label, mats in (('empty', None), ('filled', materials)):
+                    document = container(num_rows, num_cols, mats)
+                    per_slot = validation_time(app, document, False)
+                    single_pass = validation_time(app, document, True)
+                    rows.append([num_rows*num_cols, label, '%.2f' % (per_slot*1000),
+                                 '%.2f' % (single_pass*1000), '%.1fx' % (per_slot/single_pass)])
+    finally:
+        drop_benchmark_db(db)
+    report('Container validation time (ms)', rows,
+           ['slots', 'slots are', 'per slot', 'single pass', 'speed-up'])
+
+
+if __name__ == '__main__':
+    main()
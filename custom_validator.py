@@ -1,30 +1,135 @@
 from eve.io.mongo import Validator
+from flask import current_app as app, g
 from uuid import UUID
 from collections import Counter
-from addresser import Addresser
+from addresser import get_addresser
 import re
 
 import pdb
 
 HMDMC_PATTERN = re.compile(r'^[0-9]{2}/[0-9]{3,4}$')
 
+# The rules the single-pass slot validation knows how to check for each slot field
+SLOT_FIELD_RULES = {
+    'address': {'type', 'address'},
+    'material': {'type', 'data_relation'},
+}
+
+
+def uuid_error(value):
+    """Return the error message for a value that is not a UUID, or None if it is one."""
+    try:
+        UUID(value)
+    except (ValueError, AttributeError, TypeError):
+        return "value %r cannot be converted to a UUID" % value
+
+
+def is_slot_schema(schema):
+    """Can slots with the given item schema be checked by the single-pass validation?"""
+    if schema.get('type') != 'dict':
+        return False
+    fields = schema.get('schema', {})
+    return (set(fields) == set(SLOT_FIELD_RULES)
+            and all(set(fields[k]) <= rules for k, rules in SLOT_FIELD_RULES.iteritems())
+            and fields['address'].get('type') == 'string'
+            and fields['material'].get('type') == 'uuid')
+
+
+def collect_relation_values(schema, document, values):
+    """Add to values, a dict of (resource, field) -> set, every value that the document
+    refers to through a data_relation in the schema."""
+    for field, value in document.iteritems():
+        definition = schema.get(field)
+        if definition and value is not None:
+            _collect_definition_values(definition, value, values)
+
+
+def _collect_definition_values(definition, value, values):
+    relation = definition.get('data_relation')
+    if relation and not relation.get('version'):
+        items = value if isinstance(value, list) else [value]
+        values.setdefault((relation['resource'], relation['field']), set()).update(
+            item for item in items if isinstance(item, basestring)
+            and not (definition.get('type') == 'uuid' and uuid_error(item)))
+    item_schema = definition.get('schema')
+    if item_schema and definition.get('type') == 'list' and isinstance(value, list):
+        for item in value:
+            if item is not None:
+                _collect_definition_values(item_schema, item, values)
+    elif item_schema and definition.get('type') == 'dict' and isinstance(value, dict):
+        collect_relation_values(item_schema, value, values)
+
+
+def clear_data_relations():
+    """Forget the data_relation values looked up so far."""
+    g.data_relations = {}
+
+
+def prefetch_data_relations(schema, documents):
+    """Look up every value the documents refer to through a data_relation, with one query
+    per related resource, and remember which exist. The validator checks the values it has
+    seen here without querying the database again."""
+    values = {}
+    for document in documents:
+        if isinstance(document, dict):
+            collect_relation_values(schema, document, values)
+    if not hasattr(g, 'data_relations'):
+        clear_data_relations()
+    for (resource, field), wanted in values.iteritems():
+        checked, existing = g.data_relations.setdefault((resource, field), (set(), set()))
+        wanted -= checked
+        if not wanted:
+            continue
+        datasource, filter_, _, _ = app.data.datasource(resource)
+        query = {field: {'$in': list(wanted)}}
+        if filter_:
+            query = {'$and': [filter_, query]}
+        for doc in app.data.driver.db[datasource].find(query, {field: 1}):
+            existing.add(doc[field])
+        checked.update(wanted)
+
+
+def known_data_relation(data_relation, value):
+    """Return True or False if the value is known to exist or not for the data_relation,
+    or None if it has not been looked up."""
+    relations = getattr(g, 'data_relations', None)
+    if not relations or not isinstance(value, basestring):
+        return None
+    checked, existing = relations.get((data_relation['resource'], data_relation['field']), ((), ()))
+    if value in checked:
+        return value in existing
+
+
+def data_relation_error(data_relation, value):
+    return "value '%s' must exist in resource '%s', field '%s'." % (
+        value, data_relation['resource'], data_relation['field'])
+
 
 class CustomValidator(Validator):
     """
     Extends the base mongo validator adding support for the uuid data-type
     """
     def _validate_type_uuid(self, field, value):
-        try:
-            UUID(value)
-        except ValueError:
-            self._error(field, "value %r cannot be converted to a UUID" % value)
+        error = uuid_error(value)
+        if error:
+            self._error(field, error)
 
     def make_addresser(self):
-        doc = self.document
-        return Addresser(
+        # An update need not repeat the container's geometry, so it is taken from the
+        # original document
+        doc = dict(self._original_document or {})
+        doc.update(self.document)
+        return get_addresser(
                 doc['num_of_rows'], doc['num_of_cols'],
                 bool(doc.get('row_is_alpha')), bool(doc.get('col_is_alpha')))
 
+    def _Validator__get_child_validator(self, **kwargs):
+        # Cerberus validates each item of a list with a new validator, which needs the
+        # original document to check the items of an update
+        validator = super(CustomValidator, self)._Validator__get_child_validator(**kwargs)
+        validator._original_document = self._original_document
+        return validator
+
     def _validate_address(self, address, field, value):
         if not address:
             return
@@ -34,10 +139,83 @@ class CustomValidator(Validator):
         except ValueError as e:
             self._error(field, e.message)
 
+    def _validate_schema(self, schema, field, value, nested_allow_unknown):
+        if not (app.config.get('FAST_SLOT_VALIDATION', True) and isinstance(value, list)
+                and is_slot_schema(schema) and self._validate_slots(schema['schema'], field, value)):
+            super(CustomValidator, self)._validate_schema(schema, field, value, nested_allow_unknown)
+
+    def _validate_slots(self, schema, field, slots):
+        """Check the addresses and materials of all the slots in one pass, reporting the
+        same errors as validating each slot with its schema would.
+        Returns False, without reporting anything, if any slot is not a well-formed
+        dict of strings; those are left to the per-slot validation.
+        """
+        doc = self.document
+        if not (isinstance(doc.get('num_of_rows'), int) and isinstance(doc.get('num_of_cols'), int)):
+            return False
+        check_address = schema['address'].get('address')
+        relation = schema['material'].get('data_relation')
+        addresser = self.make_addresser()
+        list_errors = {}
+        counts = Counter()
+        for i, slot in enumerate(slots):
+            if not isinstance(slot, dict) or not isinstance(slot.get('address'), basestring):
+                return False
+            material = slot.get('material', '')
+            if not isinstance(material, basestring) or any(k not in schema for k in slot):
+                return False
+            address = slot['address']
+            counts[address] += 1
+            errors = {}
+            if check_address:
+                try:
+                    addresser.index(address)
+                except ValueError as e:
+                    errors['address'] = e.message
+            if 'material' in slot:
+                error = uuid_error(material)
+                if not error and relation and not self._related_exists(relation, material):
+                    error = data_relation_error(relation, material)
+                if error:
+                    errors['material'] = error
+            if errors:
+                list_errors[i] = errors
+        if list_errors:
+            self._error(field, list_errors)
+        self._slot_address_counts = (slots, counts)
+        return True
+
+    def _related_exists(self, data_relation, value):
+        exists = known_data_relation(data_relation, value)
+        if exists is None:
+            exists = app.data.find_one(data_relation['resource'], None, **{data_relation['field']: value})
+        return exists
+
+    def _validate_data_relation(self, data_relation, field, value):
+        items = value if isinstance(value, list) else [value]
+        if data_relation.get('version'):
+            known = None
+        else:
+            known = [known_data_relation(data_relation, item) for item in items]
+        if known is None or None in known:
+            return super(CustomValidator, self)._validate_data_relation(data_relation, field, value)
+        for item, exists in zip(items, known):
+            if not exists:
+                self._error(field, data_relation_error(data_relation, item))
+
+    def _validate(self, document, schema=None, update=False, context=None):
+        if context is None and isinstance(document, dict):
+            prefetch_data_relations(schema or self.schema, [document])
+        return super(CustomValidator, self)._validate(document, schema, update, context)
+
     def _validate_uniqueaddresses(self, unique_addresses, field, value):
         if not unique_addresses:
             return
-        c = Counter(x["address"] for x in value)
+        counted = getattr(self, '_slot_address_counts', None)
+        if counted and counted[0] is value:
+            c = counted[1]
+        else:
+            c = Counter(x["address"] for x in value)
 
         for x, i in c.iteritems():
             if i > 1:
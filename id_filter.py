@@ -0,0 +1,169 @@
+import hashlib
+import math
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class BloomFilter(object):
+    """A Bloom filter of strings: a value that was never added is (almost always) reported
+    as absent, and a value that was added is always reported as present."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2)**2))
+        self.num_hashes = max(int(round(self.num_bits / float(self.capacity) * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(str(value)).digest())
+        return [(h1 + i*h2) % self.num_bits for i in xrange(self.num_hashes)]
+
+    def add(self, value):
+        positions = self._positions(value)
+        with self._lock:
+            # Values added again (or false positives) don't use up any capacity
+            if all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions):
+                return
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def false_positive_rate(self):
+        """The expected rate of false positives with the number of values added so far."""
+        return (1 - math.exp(-self.num_hashes * self.count / float(self.num_bits))) ** self.num_hashes
+
+    def memory(self):
+        return len(self.bits)
+
+
+class IdFilter(object):
+    """Remembers the ids of the documents in a collection, so that ids which are certainly
+    not in it can be found without querying it.
+
+    Other workers insert documents too, so before trusting that an id is absent, sync()
+    adds the ids of the documents created since the last sync (less a margin, for inserts
+    which were still in progress). That is one query per lookup that finds an absent id,
+    unless sync_interval is set: then the filter syncs at most once every sync_interval
+    seconds, and an id inserted by another worker since the last sync may be reported
+    absent. Deleted ids cannot be removed from the filter, so they are looked up in the
+    collection like any other id the filter may hold.
+
+    Once more ids than its capacity have been added, the filter is rebuilt with a larger
+    capacity in a background thread, and the full one is used until the new one is ready.
+    """
+
+    def __init__(self, capacity, error_rate=0.001, sync_margin=60, sync_interval=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_margin = timedelta(seconds=sync_margin)
+        self.sync_interval = sync_interval
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.synced_from = None
+        self.last_synced = None
+        self.deleted = 0
+        self.lookups = self.negatives = self.false_positives = 0
+        self.syncs = self.rebuilds = 0
+        self.rebuild_thread = None
+        self._lock = threading.Lock()
+
+    def warm(self, collection):
+        """Fill the filter with the ids of every document in the collection."""
+        started = datetime.utcnow()
+        count = collection.count()
+        bloom = BloomFilter(max(self.capacity, 2*count), self.error_rate)
+        for doc in collection.find({}, {'_id': 1}):
+            bloom.add(doc['_id'])
+        with self._lock:
+            self.bloom = bloom
+            self.capacity = bloom.capacity
+            self.synced_from = started - self.sync_margin
+            # Ids added to the old filter during the scan are found by the next sync
+            self.last_synced = None
+            self.deleted = 0
+
+    def rebuild(self, collection):
+        """Start warming a new filter in a background thread, unless one is already being
+        built, and return the thread."""
+        with self._lock:
+            if self.rebuild_thread is None or not self.rebuild_thread.is_alive():
+                self.rebuild_thread = threading.Thread(target=self.warm, args=(collection,))
+                self.rebuild_thread.daemon = True
+                self.rebuild_thread.start()
+                self.rebuilds += 1
+            return self.rebuild_thread
+
+    def sync(self, collection):
+        """Add the ids of the documents created since the last sync, unless the filter
+        synced less than sync_interval seconds ago. If the filter has grown beyond its
+        capacity, a larger one is rebuilt in the background."""
+        if self.synced_from is None:
+            self.warm(collection)
+            return
+        if self.bloom.count > self.capacity:
+            self.rebuild(collection)
+        now = time.time()
+        if self.last_synced is not None and now - self.last_synced < self.sync_interval:
+            return
+        started = datetime.utcnow()
+        bloom = self.bloom
+        for doc in collection.find({'_created': {'$gte': self.synced_from}}, {'_id': 1}):
+            bloom.add(doc['_id'])
+        with self._lock:
+            if bloom is self.bloom:
+                self.synced_from = started - self.sync_margin
+                self.last_synced = now
+        self.syncs += 1
+
+    def add(self, _id):
+        self.bloom.add(_id)
+
+    def remove(self, _id):
+        # A Bloom filter cannot forget an id, so a deleted id is only counted
+        self.deleted += 1
+
+    def absent(self, collection, ids):
+        """Return the set of the given ids which are certainly not in the collection."""
+        absent = {_id for _id in ids if _id not in self.bloom}
+        if absent:
+            self.sync(collection)
+            absent = {_id for _id in absent if _id not in self.bloom}
+        self.lookups += len(ids)
+        self.negatives += len(absent)
+        return absent
+
+    def record_false_positives(self, count):
+        """Count the ids which the filter could not rule out, but were not found."""
+        self.false_positives += count
+
+    def stats(self):
+        bloom = self.bloom
+        maybe_present = self.lookups - self.negatives
+        return {
+            'count': bloom.count,
+            'capacity': bloom.capacity,
+            'deleted': self.deleted,
+            'bits': bloom.num_bits,
+            'hashes': bloom.num_hashes,
+            'memory_bytes': bloom.memory(),
+            'expected_false_positive_rate': bloom.false_positive_rate(),
+            'lookups': self.lookups,
+            'negatives': self.negatives,
+            'false_positives': self.false_positives,
+            'syncs': self.syncs,
+            'sync_interval': self.sync_interval,
+            'rebuilds': self.rebuilds,
+            'rebuilding': self.rebuild_thread is not None and self.rebuild_thread.is_alive(),
+            'observed_false_positive_rate': (self.false_positives / float(maybe_present)
+                                             if maybe_present else None),
+        }
@@ -0,0 +1,30 @@
+import json
+
+
+def batched(values, size):
+    """Yield lists of up to size consecutive values from an iterable."""
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ndjson_rows(lines):
+    """Yield (document, issues) for each non-blank line of newline-delimited JSON, where
+    issues is None, or a dict describing why the line is not a JSON object."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            document = json.loads(line)
+        except ValueError as e:
+            yield None, {'json': str(e)}
+            continue
+        if not isinstance(document, dict):
+            yield None, {'json': 'Each line must be a JSON object'}
+            continue
+        yield document, None
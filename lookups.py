@@ -0,0 +1,78 @@
+import functools
+import itertools
+
+
+def unique(values):
+    """Return a list of the given values in order, without repeats."""
+    seen = set()
+    return [value for value in values if not (value in seen or seen.add(value))]
+
+
+def chunked(values, size):
+    """Yield successive lists of up to size of the given values."""
+    for start in xrange(0, len(values), size):
+        yield values[start:start+size]
+
+
+def find_by_ids(collection, ids, projection=None, chunk_size=1000):
+    """Yield the documents in the collection with the given ids, looking them up with an
+    $in of at most chunk_size ids at a time so that long lists give queries of
+    predictable size."""
+    ids = list(ids)
+    for chunk in chunked(ids, chunk_size):
+        for doc in collection.find({'_id': {'$in': chunk}}, projection):
+            yield doc
+
+
+def _missing_from_chunk(collection, ids):
+    found = {doc['_id'] for doc in collection.find({'_id': {'$in': ids}}, {'_id': 1})}
+    return [_id for _id in ids if _id not in found]
+
+
+def missing_ids(collection, ids, chunk_size=1000, pool=None):
+    """Return an iterator over lists of the given ids (in order, without repeats) which are
+    not in the collection, one list for each chunk of ids. If a thread pool is given, the
+    chunks are looked up concurrently on it."""
+    lookup = functools.partial(_missing_from_chunk, collection)
+    chunks = chunked(unique(ids), chunk_size)
+    if pool is None:
+        return itertools.imap(lookup, chunks)
+    return pool.imap(lookup, chunks)
+
+
+def _find_chunk(collection, projection, ids):
+    docs = {doc['_id']: doc for doc in collection.find({'_id': {'$in': ids}}, projection)}
+    return [(_id, docs.get(_id)) for _id in ids]
+
+
+def find_in_order(collection, ids, projection=None, chunk_size=1000, pool=None):
+    """Return an iterator over lists of (id, document) pairs, one list for each chunk of the
+    given ids (in order, without repeats), where the document is None if there is none with
+    that id. If a thread pool is given, the chunks are looked up concurrently on it."""
+    lookup = functools.partial(_find_chunk, collection, projection)
+    chunks = chunked(unique(ids), chunk_size)
+    if pool is None:
+        return itertools.imap(lookup, chunks)
+    return pool.imap(lookup, chunks)
+
+
+def find_owners(collection, ids, chunk_size=1000):
+    """Return a dict mapping each of the given ids that exists in the collection to the
+    owner_id of its document."""
+    return {doc['_id']: doc.get('owner_id')
+            for doc in find_by_ids(collection, set(ids), {'owner_id': 1}, chunk_size)}
+
+
+def ownership_issues(owners, ids, owner_id):
+    """Return the ids (in the order given, without repeats) which are missing from the owners
+    dict, and those which belong to someone other than owner_id."""
+    missing, foreign, seen = [], [], set()
+    for _id in ids:
+        if _id in seen:
+            continue
+        seen.add(_id)
+        if _id not in owners:
+            missing.append(_id)
+        elif owners[_id] != owner_id:
+            foreign.append(_id)
+    return missing, foreign
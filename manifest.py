@@ -0,0 +1,98 @@
+import codecs
+import csv
+import re
+
+TRUE_VALUES = frozenset(['true', 'yes', 'y', '1'])
+FALSE_VALUES = frozenset(['false', 'no', 'n', '0'])
+
+
+def header_patterns(schema):
+    """Return the compiled field_name_regex of each field in a resource schema that has one."""
+    return {field: re.compile(definition['field_name_regex'])
+            for field, definition in schema.iteritems() if definition.get('field_name_regex')}
+
+
+def map_headers(headers, schema, patterns):
+    """Return the field each column of a manifest is for (or None), given its headers. A header
+    names a field if it is the field's name, or it matches the field's field_name_regex once
+    trimmed and lower-cased. Raises a ValueError if two columns are for the same field."""
+    fields = []
+    for header in headers:
+        name = header.strip().lower()
+        if name in schema and not name.startswith('_'):
+            field = name
+        else:
+            field = next((f for f, pattern in sorted(patterns.iteritems()) if pattern.search(name)), None)
+        if field is not None and field in fields:
+            raise ValueError("Columns %r and %r are both for %s" % (
+                headers[fields.index(field)], header, field))
+        fields.append(field)
+    return fields
+
+
+def coerce_cell(definition, value):
+    """Convert the text of a cell to the type of its field, leaving it as text if it cannot
+    be converted so that validation reports it."""
+    field_type = definition.get('type')
+    try:
+        if field_type == 'boolean':
+            lower = value.lower()
+            if lower in TRUE_VALUES:
+                return True
+            if lower in FALSE_VALUES:
+                return False
+        elif field_type == 'float':
+            return float(value)
+        elif field_type == 'integer':
+            return int(value)
+    except ValueError:
+        pass
+    return value
+
+
+def manifest_rows(lines, schema, patterns, delimiter=None):
+    """Read a CSV or TSV manifest, with a header row, from an iterable of lines. Return the
+    field of each column and an iterator of (document, issues) rows, in which empty cells are
+    left out. The delimiter is a tab if the header row has one, unless it is given. The
+    manifest must be UTF-8 CSV: a header row that cannot be read raises a ValueError, and
+    any other row that cannot be read is reported in its issues."""
+    lines = iter(lines)
+    header_line = next(lines, '')
+    if header_line.startswith(codecs.BOM_UTF8):
+        header_line = header_line[len(codecs.BOM_UTF8):]
+    if delimiter is None:
+        delimiter = '\t' if '\t' in header_line else ','
+    try:
+        headers = [h.decode('utf-8') for h in next(csv.reader([header_line], delimiter=delimiter), [])]
+    except UnicodeDecodeError as e:
+        raise ValueError("The header row is not UTF-8: %s" % e)
+    except csv.Error as e:
+        raise ValueError("The header row cannot be read: %s" % e)
+    if not headers:
+        raise ValueError("The manifest has no header row")
+    fields = map_headers(headers, schema, patterns)
+    columns = [(i, field, schema[field]) for i, field in enumerate(fields) if field is not None]
+
+    def rows():
+        reader = csv.reader(lines, delimiter=delimiter)
+        while True:
+            try:
+                cells = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield None, {'csv': "The row cannot be read: %s" % e}
+                continue
+            if not any(cell.strip() for cell in cells):
+                continue
+            document = {}
+            try:
+                for i, field, definition in columns:
+                    if i < len(cells) and cells[i].strip():
+                        document[field] = coerce_cell(definition, cells[i].strip().decode('utf-8'))
+            except UnicodeDecodeError as e:
+                yield None, {'encoding': "The row is not UTF-8: %s" % e}
+                continue
+            yield document, None
+
+    return headers, fields, rows()
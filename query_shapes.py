@@ -0,0 +1,132 @@
+import threading
+import time
+
+from bson import SON
+
+# Operators which an index can serve like a plain equality match. Any other operator
+# is treated as selecting a range of index keys.
+EQUALITY_OPERATORS = frozenset(['$eq', '$in'])
+
+
+def filter_shape(where):
+    """Return the shape of a where filter: a sorted tuple of (field, operators) pairs, with
+    the values left out. Top-level operators such as $or appear as fields."""
+    conditions = {}
+    _add_conditions(where or {}, conditions)
+    return tuple(sorted((field, tuple(sorted(ops))) for field, ops in conditions.iteritems()))
+
+
+def _add_conditions(where, conditions):
+    for key, value in where.iteritems():
+        if key == '$and' and isinstance(value, list):
+            for clause in value:
+                if isinstance(clause, dict):
+                    _add_conditions(clause, conditions)
+        elif key.startswith('$'):
+            conditions.setdefault(key, set()).add(key)
+        elif isinstance(value, dict) and value and all(k.startswith('$') for k in value):
+            conditions.setdefault(key, set()).update(value)
+        else:
+            conditions.setdefault(key, set()).add('$eq')
+
+
+def recommend_index(shape, sort):
+    """Return the compound index key which best serves queries of the given shape and sort,
+    with the equality fields first, then the sort fields, then the range fields. Returns
+    None if the shape cannot use a single index."""
+    if any(field.startswith('$') for field, _ in shape):
+        return None
+    equality = [field for field, ops in shape if set(ops) <= EQUALITY_OPERATORS]
+    key = [(field, 1) for field in equality]
+    for field, direction in sort or ():
+        if field not in equality:
+            key.append((field, direction))
+    for field, _ in shape:
+        if field not in equality and field not in dict(key):
+            key.append((field, 1))
+    return key or None
+
+
+def index_covers(index_key, key):
+    """Does an existing index with index_key serve queries that want the given key?"""
+    index_key = [(field, direction) for field, direction in index_key]
+    if len(index_key) < len(key):
+        return False
+    prefix = index_key[:len(key)]
+    reverse = [(field, -direction) for field, direction in key]
+    return prefix == key or prefix == reverse
+
+
+def explain_command(collection_name, where, sort=None, limit=None):
+    """Return the explain command which reports the plan MongoDB would choose for a find,
+    without running the query."""
+    find = SON([('find', collection_name), ('filter', where or {})])
+    if sort:
+        find['sort'] = SON(sort)
+    if limit:
+        find['limit'] = limit
+    return SON([('explain', find), ('verbosity', 'queryPlanner')])
+
+
+def plan_stages(plan):
+    """Yield the name of every stage in a query plan from explain."""
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        for stage in plan_stages(plan['inputStage']):
+            yield stage
+    for input_stage in plan.get('inputStages', ()):
+        for stage in plan_stages(input_stage):
+            yield stage
+
+
+def is_collection_scan(explanation):
+    """Does the winning plan in the output of explain scan the whole collection?"""
+    return 'COLLSCAN' in plan_stages(explanation['queryPlanner']['winningPlan'])
+
+
+class QueryShapeRecorder(object):
+    """Counts the searches made for each query shape and sort, with their latencies."""
+
+    def __init__(self, max_shapes=1000):
+        self.max_shapes = max_shapes
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, where, sort, seconds):
+        key = (filter_shape(where), tuple((field, direction) for field, direction in sort or ()))
+        ms = seconds*1000
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_shapes:
+                    return
+                stats = self._stats[key] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+
+    def timer(self):
+        """Return a function which records, when called with a where and a sort, the time
+        since timer() was called."""
+        start = time.time()
+        return lambda where, sort: self.record(where, sort, time.time() - start)
+
+    def report(self, index_keys=()):
+        """Return the recorded shapes, most time-consuming first, each with the index
+        recommended for it and whether one of the given index keys already serves it."""
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._stats.iteritems()]
+        report = []
+        for (shape, sort), stats in items:
+            index = recommend_index(shape, sort)
+            stats.update({
+                'filter': {field: list(ops) for field, ops in shape},
+                'sort': [list(s) for s in sort],
+                'mean_ms': stats['total_ms'] / stats['count'],
+                'index': [list(k) for k in index] if index else None,
+                'index_exists': bool(index) and any(index_covers(existing, index)
+                                                    for existing in index_keys),
+            })
+            report.append(stats)
+        report.sort(key=lambda stats: stats['total_ms'], reverse=True)
+        return report
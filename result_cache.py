@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalGenerations(object):
+    """The generation of each resource, kept in this process."""
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, resource):
+        return self._generations.get(resource, 0)
+
+    def increment(self, resource):
+        with self._lock:
+            self._generations[resource] = self._generations.get(resource, 0) + 1
+
+
+class MongoGenerations(object):
+    """The generation of each resource, kept in a MongoDB collection so that a write in
+    any worker invalidates the results cached by every worker."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, resource):
+        doc = self.collection.find_one({'_id': resource})
+        return doc['generation'] if doc else 0
+
+    def increment(self, resource):
+        self.collection.update_one({'_id': resource}, {'$inc': {'generation': 1}}, upsert=True)
+
+
+class ResultCache(object):
+    """An LRU cache of serialised search responses, whose entries expire after ttl seconds.
+    Each resource has a generation, which invalidating the resource increases, and entries
+    cached under an older generation are never returned.
+    """
+
+    def __init__(self, max_entries=256, ttl=30, generations=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generations = generations or LocalGenerations()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def generation(self, resource):
+        """Return the resource's current generation, which should be read before querying
+        for a result that will be cached."""
+        return self.generations.get(resource)
+
+    def get(self, resource, key, generation):
+        """Return the cached response for the key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop((resource, key), None)
+            if entry is None or entry[1] != generation or entry[2] <= now:
+                self.misses += 1
+                return None
+            self._entries[(resource, key)] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, resource, key, value, generation):
+        with self._lock:
+            self._entries.pop((resource, key), None)
+            self._entries[(resource, key)] = (value, generation, time.time() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, resource):
+        """Stop returning the responses cached for the resource."""
+        self.generations.increment(resource)
+        self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -6,24 +6,42 @@ import logging
 import uuid
 import json
 import copy
+import itertools
 import pdb
+import threading
 
 from logstash_async.handler import AsynchronousLogstashHandler
+from multiprocessing.pool import ThreadPool
 from uuid_encoder import UUIDEncoder
-from custom_validator import CustomValidator
+from custom_validator import CustomValidator, clear_data_relations, prefetch_data_relations
 from eve import Eve
-from flask import request, jsonify, abort, Response, current_app
+from flask import request, jsonify, abort, Response, current_app, stream_with_context
+from eve.defaults import resolve_default_values
+from eve.methods.common import parse, resolve_document_etag
+from eve.validation import ValidationError
 from eve_swagger import swagger
 from flask_swagger_ui import get_swaggerui_blueprint
 from bson import json_util
 from flask_zipkin import Zipkin
-from pymongo import ReturnDocument
-from addresser import Addresser
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ExecutionTimeout
+from slots import (container_addresser, fill_empty_slots, remove_empty_slots, slot_updates,
+                   find_material_locations)
+from barcodes import BarcodeAllocator
+from importer import batched, ndjson_rows
+from manifest import header_patterns, manifest_rows
+from lookups import chunked, find_in_order, find_owners, missing_ids, ownership_issues, unique
+from id_filter import IdFilter
+from serialization import make_dumps
+from query_shapes import explain_command, filter_shape, is_collection_scan, QueryShapeRecorder
+from result_cache import MongoGenerations, ResultCache
+from search import (decode_cursor, encode_cursor, facet_pipeline, include_fields, keyset_filter,
+                    pop_field, projection_profiles, searchable_fields, WhereNormaliser)
+from werkzeug.datastructures import ImmutableMultiDict
 from flask_login import LoginManager, current_user
 from jwt_auth import JWTAuth
 from user import User
 from datetime import datetime
-from eve.utils import date_to_str, str_to_date
 
 environment = os.getenv('EVE_ENV', 'development')
 
@@ -31,6 +49,15 @@ SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', e
 SWAGGER_URL = '/docs'  # URL for exposing Swagger UI (without trailing '/')
 API_URL = '/api-docs'  # Our API url (can of course be a local resource)
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# The delimiter of manifests uploaded with each content type. Otherwise it is found
+# from the header row.
+MANIFEST_DELIMITERS = {'text/csv': ',', 'text/tab-separated-values': '\t'}
+
+# How searches can count their results: exactly, approximately, or not at all
+TOTAL_MODES = ('exact', 'estimate', 'none')
+
 FORM_FIELD_ORDER = {k: i for i, k in enumerate(
     ["donor_id", "supplier_name", "hmdmc", "is_tumour", "gender", "tissue_type", "taxon_id",
      "scientific_name", "phenotype"])}
@@ -69,34 +96,93 @@ def create_app(settings):
 
     app.on_insert += set_uuid
 
+    @app.before_request
+    def reset_data_relations():
+        clear_data_relations()
+
+    def prefetch_payload_data_relations(resource, request):
+        # Check every data_relation value of a (bulk) payload with one query per
+        # resource, before the documents are validated one by one
+        payload = request.get_json(silent=True)
+        if payload:
+            documents = payload if isinstance(payload, list) else [payload]
+            prefetch_data_relations(app.config['DOMAIN'][resource]['schema'], documents)
+
+    app.on_pre_POST += prefetch_payload_data_relations
+
+    # Serialised search responses, kept for SEARCH_CACHE_TTL seconds unless the resource
+    # is written to first. app.search_cache is None if SEARCH_CACHE_SIZE is 0.
+    app.search_cache = None
+    if app.config.get('SEARCH_CACHE_SIZE'):
+        generations = None
+        if app.config.get('SEARCH_CACHE_SHARED'):
+            with app.app_context():
+                generations = MongoGenerations(current_app.data.driver.db.search_cache_generations)
+        app.search_cache = ResultCache(app.config['SEARCH_CACHE_SIZE'],
+                                       app.config.get('SEARCH_CACHE_TTL', 30),
+                                       generations)
+
+    def invalidate_search_cache(resource, *args):
+        if app.search_cache is not None:
+            app.search_cache.invalidate(resource)
+
+    app.on_inserted += invalidate_search_cache
+    app.on_updated += invalidate_search_cache
+    app.on_replaced += invalidate_search_cache
+    app.on_deleted_item += invalidate_search_cache
+    app.on_deleted_resource += invalidate_search_cache
+
     # Containers hooks
-    def set_barcode_if_not_present(containers):
-        for container in containers:
-            if 'barcode' not in container:
-                result = app.data.driver.db.counters.find_one_and_update(
-                    {'_id': 'barcode'},
-                    {'$inc': {'seq': 1}},
-                    return_document=ReturnDocument.AFTER)
+    barcode_allocator = BarcodeAllocator(app.config.get('BARCODE_BLOCK_SIZE', 0))
 
-                container['barcode'] = 'AKER-%s' % result['seq']
+    def set_barcode_if_not_present(containers):
+        missing = [container for container in containers if 'barcode' not in container]
+        if not missing:
+            return
+        barcodes = barcode_allocator.barcodes(app.data.driver.db.counters, len(missing))
+        for container, barcode in zip(missing, barcodes):
+            container['barcode'] = barcode
 
     def insert_empty_slots(containers):
         for container in containers:
-            addresser = Addresser(container['num_of_rows'],
-                                  container['num_of_cols'],
-                                  bool(container.get('row_is_alpha')),
-                                  bool(container.get('col_is_alpha')))
-            slots = container.get('slots')
-            if not slots:
-                container['slots'] = [{'address': address} for address in addresser]
+            if app.config.get('SPARSE_SLOTS'):
+                container.setdefault('slots', [])
+                remove_empty_slots(container)
             else:
-                definedaddresses = {slot['address'] for slot in container['slots']}
-                for address in addresser:
-                    if address not in definedaddresses:
-                        slots.append({'address': address})
+                fill_empty_slots(container)
+
+    def remove_empty_slots_from_update(updates, original):
+        if app.config.get('SPARSE_SLOTS') and 'slots' in updates:
+            remove_empty_slots(updates)
+
+    def empty_slots_requested(args=None):
+        """Does the request ask for the empty slots (with ?empty_slots=1, or an empty_slots
+        argument in the body of a search) to be rebuilt?"""
+        value = request.args.get('empty_slots', '') if args is None else args.get('empty_slots')
+        return str(value).lower() in ('1', 'true')
+
+    def fill_stored_empty_slots(container):
+        if 'slots' in container and 'num_of_rows' in container and 'num_of_cols' in container:
+            fill_empty_slots(container)
+
+    def fill_requested_empty_slots(containers):
+        if not empty_slots_requested():
+            return
+        for container in containers:
+            fill_stored_empty_slots(container)
+
+    def fill_requested_empty_slots_item(response):
+        fill_requested_empty_slots([response])
+
+    def fill_requested_empty_slots_resource(response):
+        fill_requested_empty_slots(response['_items'])
 
     app.on_insert_containers += set_barcode_if_not_present
     app.on_insert_containers += insert_empty_slots
+    app.on_update_containers += remove_empty_slots_from_update
+    app.on_replace_containers += remove_empty_slots_from_update
+    app.on_fetched_item_containers += fill_requested_empty_slots_item
+    app.on_fetched_resource_containers += fill_requested_empty_slots_resource
 
     # Materials hooks
     def set_owner_id(materials):
@@ -106,35 +192,108 @@ def create_app(settings):
 
     app.on_insert_materials += set_owner_id
 
-    # Very rudimentary validation method... just for development!
+    # Threads for looking up long lists of ids in concurrent chunks. The pool is started on
+    # first use, so that it belongs to the worker process rather than a parent it forked from.
+    lookup_pool = []
+    lookup_pool_lock = threading.Lock()
+
+    def get_lookup_pool():
+        threads = app.config.get('LOOKUP_THREADS', 4)
+        if threads <= 1:
+            return None
+        with lookup_pool_lock:
+            if not lookup_pool:
+                lookup_pool.append(ThreadPool(threads))
+        return lookup_pool[0]
+
+    # A filter of the material ids in this worker, which rules out most materials that do not
+    # exist without a query. app.material_id_filter is None unless MATERIAL_ID_FILTER is set.
+    app.material_id_filter = None
+    if app.config.get('MATERIAL_ID_FILTER'):
+        app.material_id_filter = IdFilter(app.config.get('MATERIAL_ID_FILTER_CAPACITY', 1000000),
+                                          app.config.get('MATERIAL_ID_FILTER_ERROR_RATE', 0.001),
+                                          sync_interval=app.config.get('MATERIAL_ID_FILTER_SYNC_INTERVAL', 0))
+        with app.app_context():
+            app.material_id_filter.warm(current_app.data.driver.db.materials)
+
+    def add_to_material_id_filter(materials):
+        if app.material_id_filter is not None:
+            for material in materials:
+                app.material_id_filter.add(material['_id'])
+
+    def remove_from_material_id_filter(material):
+        if app.material_id_filter is not None:
+            app.material_id_filter.remove(material['_id'])
+
+    app.on_inserted_materials += add_to_material_id_filter
+    app.on_deleted_item_materials += remove_from_material_id_filter
+
+    def absent_materials(materials):
+        """Return the set of the given materials which the id filter shows do not exist."""
+        if app.material_id_filter is None:
+            return set()
+        return app.material_id_filter.absent(app.data.driver.db.materials, materials)
+
+    @app.route('/materials/id_filter', methods=['GET'])
+    def material_id_filter_stats(**lookup):
+        if app.material_id_filter is None:
+            abort(404, description="The material id filter is not enabled")
+        return Response(response=json.dumps(app.material_id_filter.stats()), status=200,
+                        mimetype="application/json")
+
+    def is_id_list(ids):
+        return isinstance(ids, list) and all(isinstance(_id, basestring) for _id in ids)
+
+    def find_missing_materials(materials):
+        """Return an iterator over lists of the given materials that do not exist, by chunk.
+        The materials ruled out by the id filter come first, without being looked up."""
+        materials = unique(materials)
+        absent = absent_materials(materials)
+        chunks = missing_ids(app.data.driver.db.materials, [m for m in materials if m not in absent],
+                             app.config.get('LOOKUP_CHUNK_SIZE', 1000), get_lookup_pool())
+        if app.material_id_filter is None:
+            return chunks
+        return itertools.chain([[m for m in materials if m in absent]],
+                               _count_false_positives(app.material_id_filter, chunks))
+
+    def _count_false_positives(id_filter, chunks):
+        # Every id looked up had passed the filter, so those not found were false positives
+        # (or have been deleted)
+        for chunk in chunks:
+            id_filter.record_false_positives(len(chunk))
+            yield chunk
+
+    # Checks that the given materials exist. Responds with "ok" or "not ok" as text, unless
+    # the request sets "report_missing", which gets the ids that do not exist as JSON. With
+    # Accept: application/x-ndjson, the ids that do not exist are streamed instead.
     @app.route('/materials/validate', methods=['POST'])
     def validate(**lookup):
-        if 'materials' not in request.json:
+        materials = request.json.get('materials')
+        if not is_id_list(materials):
             abort(422)
 
-        if (validate_existence(request.json['materials'])):
-            return "ok"
-        else:
-            return "not ok - some materials not found"
-
-    def validate_existence(materials):
-        validation_set = set(materials)
-        result_set = set()
+        missing_chunks = find_missing_materials(materials)
 
-        for material in app.data.driver.db.materials.find(
-                {'_id': {'$in': materials}}, {'_id': 1}):
-            result_set.add(material['_id'])
+        if request.accept_mimetypes.best_match(['text/plain', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            lines = (json.dumps(_id) + '\n' for chunk in missing_chunks for _id in chunk)
+            return Response(lines, status=200, mimetype=NDJSON_MIMETYPE)
 
-        difference = validation_set - result_set
+        missing = [_id for chunk in missing_chunks for _id in chunk]
+        if request.json.get('report_missing'):
+            response_body = json.dumps({'valid': not missing, 'missing': missing})
+            return Response(response=response_body, status=200, mimetype="application/json")
 
-        return not difference
+        if not missing:
+            return "ok"
+        else:
+            return "not ok - some materials not found"
 
     @app.route('/materials/verify_ownership', methods=['POST'])
     def verify_ownership(**lookup):
         materials = request.json.get('materials')
         owner_id = request.json.get('owner_id')
 
-        if materials is None or not owner_id:
+        if not is_id_list(materials) or not isinstance(owner_id, basestring) or not owner_id:
             abort(422)
 
         if len(materials) == 0:
@@ -142,29 +301,271 @@ def create_app(settings):
             # successful
             return Response(status=200, mimetype="application/json")
 
-        if not validate_existence(materials):
+        forbidden = ownership_error(materials, owner_id)
+        if forbidden is not None:
+            return forbidden
+
+        return Response(status=200, mimetype="application/json")
+
+    def ownership_error(materials, owner_id):
+        """Abort with a 422 if any of the materials does not exist. Return a 403 response if
+        any of them belongs to someone other than owner_id, or None if they all belong to them."""
+        if absent_materials(unique(materials)):
             abort(422, description="There was at least one material that did not exist")
 
-        find_args = {
-            '$and': [
-                {'_id': {'$in': materials}},
-                {'owner_id': {'$ne': owner_id}}
-            ]
-        }
+        # One projection of _id and owner_id answers both which materials are missing and
+        # which belong to someone else
+        owners = find_owners(app.data.driver.db.materials, materials,
+                             app.config.get('LOOKUP_CHUNK_SIZE', 1000))
+        missing, foreign = ownership_issues(owners, materials, owner_id)
 
-        materials_cursor = app.data.driver.db.materials.find(find_args)
+        if missing:
+            abort(422, description="There was at least one material that did not exist")
 
-        if materials_cursor.count() > 0:
+        if foreign:
             response_body = json.dumps({
                 "_status": "ERR",
-                "_error": "{0} material(s) do not belong to {1}".format(materials_cursor.count(),
-                                                                        owner_id),
-                "_issues": [material['_id'] for material in materials_cursor]
+                "_error": "{0} material(s) do not belong to {1}".format(len(foreign), owner_id),
+                "_issues": foreign
             })
 
             return Response(status=403, response=response_body, mimetype="application/json")
 
-        return Response(status=200, mimetype="application/json")
+        return None
+
+    @app.route('/materials/transfer_ownership', methods=['POST'])
+    def transfer_ownership(**lookup):
+        if not app.auth.authorized(None, 'materials', 'PATCH'):
+            return app.auth.authenticate()
+
+        materials = request.json.get('materials')
+        from_owner = request.json.get('from_owner')
+        to_owner = request.json.get('to_owner')
+
+        if not is_id_list(materials) or not isinstance(from_owner, basestring) or not from_owner \
+                or not isinstance(to_owner, basestring) or not to_owner:
+            abort(422)
+
+        forbidden = ownership_error(materials, from_owner)
+        if forbidden is not None:
+            return forbidden
+
+        # The owner_id guard leaves alone any material given to someone else since the check
+        matched = modified = 0
+        changes = {
+            '$set': {'owner_id': to_owner,
+                     app.config['LAST_UPDATED']: datetime.utcnow().replace(microsecond=0)},
+            '$unset': {app.config['ETAG']: ''},
+        }
+        for chunk in chunked(unique(materials), app.config.get('LOOKUP_CHUNK_SIZE', 1000)):
+            result = app.data.driver.db.materials.update_many(
+                {'_id': {'$in': chunk}, 'owner_id': from_owner}, changes)
+            matched += result.matched_count
+            modified += result.modified_count
+        invalidate_search_cache('materials')
+
+        response_body = json.dumps({"_status": "OK", "matched": matched, "modified": modified})
+        return Response(status=200, response=response_body, mimetype="application/json")
+
+    def import_batch(resource, rows):
+        """Validate and insert a batch of (document, issues) rows as a POST to the resource
+        would, except that the valid documents are inserted even if others are not. Return
+        a result for each row."""
+        resource_def = app.config['DOMAIN'][resource]
+        schema = resource_def['schema']
+        now = datetime.utcnow().replace(microsecond=0)
+
+        # Check the batch's data relations with one query per related resource
+        clear_data_relations()
+        prefetch_data_relations(schema, [document for document, issues in rows if document])
+
+        results = []
+        documents = []
+        positions = []
+        validator = app.validator(schema, resource=resource)
+        for document, issues in rows:
+            if not issues:
+                try:
+                    document = parse(document, resource)
+                    if validator.validate(document):
+                        document = validator.document
+                        document[app.config['LAST_UPDATED']] = document[app.config['DATE_CREATED']] = now
+                        resolve_default_values(document, resource_def['defaults'])
+                    else:
+                        issues = validator.errors
+                except ValidationError as e:
+                    issues = {'validator exception': str(e)}
+            if issues:
+                results.append({"_status": "ERR", "_issues": issues})
+            else:
+                positions.append(len(results))
+                results.append(None)
+                documents.append(document)
+
+        if not documents:
+            return results
+
+        app.on_insert(resource, documents)
+        getattr(app, 'on_insert_' + resource)(documents)
+        resolve_document_etag(documents, resource)
+
+        # Unordered, so that a document which cannot be written does not stop the rest
+        try:
+            app.data.driver.db[resource].insert_many(documents, ordered=False)
+            write_errors = {}
+        except BulkWriteError as e:
+            write_errors = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+
+        inserted = []
+        for i, (position, document) in enumerate(zip(positions, documents)):
+            if i in write_errors:
+                results[position] = {"_status": "ERR", "_issues": {'write': write_errors[i]}}
+            else:
+                results[position] = {"_status": "OK", "_id": document['_id']}
+                inserted.append(document)
+        if inserted:
+            app.on_inserted(resource, inserted)
+            getattr(app, 'on_inserted_' + resource)(inserted)
+
+        return results
+
+    @app.route('/materials/import', methods=['POST'])
+    def import_materials(**lookup):
+        """Import materials from newline-delimited JSON, one material per line. The body is
+        read, validated and inserted IMPORT_BATCH_SIZE lines at a time, and invalid lines do
+        not stop the others being inserted. The response has the result for each line, in
+        order: its _id, or its issues."""
+        if not app.auth.authorized(None, 'materials', 'POST'):
+            return app.auth.authenticate()
+
+        batch_size = app.config.get('IMPORT_BATCH_SIZE', 1000)
+        results = []
+        for rows in batched(ndjson_rows(request.stream), batch_size):
+            results.extend(import_batch('materials', rows))
+        return import_response(results)
+
+    # The compiled field_name_regex of each material field, for mapping manifest headers
+    material_header_patterns = header_patterns(app.config['DOMAIN']['materials']['schema'])
+
+    @app.route('/materials/manifest', methods=['POST'])
+    def import_material_manifest(**lookup):
+        """Import materials from a CSV or TSV manifest. The headers are matched to fields by
+        their field_name_regex, and the rows are imported in batches like /materials/import."""
+        if not app.auth.authorized(None, 'materials', 'POST'):
+            return app.auth.authenticate()
+
+        delimiter = MANIFEST_DELIMITERS.get(request.mimetype)
+        try:
+            headers, fields, rows = manifest_rows(request.stream, app.config['DOMAIN']['materials']['schema'],
+                                                  material_header_patterns, delimiter)
+        except ValueError as e:
+            abort(422, description=str(e))
+
+        batch_size = app.config.get('IMPORT_BATCH_SIZE', 1000)
+        results = []
+        for batch in batched(rows, batch_size):
+            results.extend(import_batch('materials', batch))
+        return import_response(results, columns=[{'header': header, 'field': field}
+                                                 for header, field in zip(headers, fields)])
+
+    def import_response(results, **extra):
+        failures = sum(1 for result in results if result['_status'] == "ERR")
+        response = {
+            "_status": "ERR" if failures else "OK",
+            "inserted": len(results) - failures,
+            "failed": failures,
+            "_items": results,
+        }
+        response.update(extra)
+        response_body = json.dumps(response)
+        if not failures:
+            status = 201
+        elif failures == len(results):
+            status = 422
+        else:
+            status = 200
+        return Response(status=status, response=response_body, mimetype="application/json")
+
+    @app.route('/materials/locations', methods=['POST'])
+    def material_locations(**lookup):
+        materials = request.json.get('materials')
+        if not is_id_list(materials):
+            abort(422)
+
+        locations = {material: None for material in materials}
+        locations.update(find_material_locations(app.data.driver.db.containers, materials))
+
+        return Response(response=json.dumps(locations), status=200, mimetype="application/json")
+
+    GEOMETRY_PROJECTION = {'num_of_rows': 1, 'num_of_cols': 1, 'row_is_alpha': 1, 'col_is_alpha': 1}
+
+    def find_container_or_404(container_id, projection):
+        container = app.data.driver.db.containers.find_one({'_id': container_id}, projection)
+        if container is None:
+            abort(404)
+        return container
+
+    @app.route('/containers/<container_id>/slots/<address>', methods=['GET'])
+    def get_slot(container_id, address):
+        projection = dict(GEOMETRY_PROJECTION, slots={'$elemMatch': {'address': address}})
+        container = find_container_or_404(container_id, projection)
+        try:
+            container_addresser(container).index(address)
+        except ValueError as e:
+            abort(404, description=e.message)
+        slots = container.get('slots') or [{'address': address}]
+        return Response(response=json.dumps(slots[0]), status=200, mimetype="application/json")
+
+    @app.route('/containers/<container_id>/slots/<address>', methods=['PATCH'])
+    def update_slot(container_id, address):
+        if not app.auth.authorized(None, 'containers', 'PATCH'):
+            return app.auth.authenticate()
+
+        if not isinstance(request.json, dict) or 'material' not in request.json:
+            abort(422)
+        return update_slots(container_id, [{'address': address, 'material': request.json['material']}])
+
+    @app.route('/containers/<container_id>/slots', methods=['PATCH'])
+    def update_slots_batch(container_id):
+        if not app.auth.authorized(None, 'containers', 'PATCH'):
+            return app.auth.authenticate()
+
+        slots = request.json
+        if not isinstance(slots, list) or not all(isinstance(slot, dict) and 'address' in slot
+                                                  for slot in slots):
+            abort(422)
+        return update_slots(container_id, slots)
+
+    def update_slots(container_id, slots):
+        """Put the given materials in the given slots of a container with positional updates,
+        without rewriting or revalidating the rest of its slots."""
+        container = find_container_or_404(container_id, GEOMETRY_PROJECTION)
+
+        # Validate the changed slots as though they were the container's only slots
+        document = dict(container, slots=[
+            {k: v for k, v in slot.iteritems() if not (k == 'material' and v is None)}
+            for slot in slots
+        ])
+        del document['_id']
+        validator = app.validator(current_app.config['DOMAIN']['containers']['schema'],
+                                  resource='containers')
+        if not validator.validate_update(document, container_id, container):
+            response_body = json.dumps({"_status": "ERR", "_issues": validator.errors})
+            return Response(status=422, response=response_body, mimetype="application/json")
+
+        sparse = app.config.get('SPARSE_SLOTS')
+        operations = []
+        for slot in slots:
+            operations.extend(slot_updates(container_id, slot['address'], slot.get('material'), sparse))
+        operations.append(UpdateOne({'_id': container_id}, {
+            '$set': {app.config['LAST_UPDATED']: datetime.utcnow().replace(microsecond=0)},
+            '$unset': {app.config['ETAG']: ''},
+        }))
+        app.data.driver.db.containers.bulk_write(operations)
+        invalidate_search_cache('containers')
+
+        response_body = json.dumps({"_status": "OK", "slots": slots})
+        return Response(status=200, response=response_body, mimetype="application/json")
 
     def cerberus_to_json_list(schema, quality):
         return [key for key, value in schema.iteritems() if value.get(quality)]
@@ -247,26 +648,57 @@ def create_app(settings):
         schema_str = json.dumps(schema_obj, default=json_util.default)
         return Response(response=schema_str, status=200, mimetype="application/json")
 
-    def process_where(where, in_date_value=False):
-        if not where:
-            return where
-        if isinstance(where, dict):
-            for k, v in where.iteritems():
-                where[k] = process_where(v, in_date_value or k == 'date_of_receipt')
-        elif isinstance(where, (list, tuple)):
-            return [process_where(x, in_date_value) for x in where]
-        elif in_date_value and isinstance(where, basestring):
-            try:
-                return str_to_date(where)
-            except ValueError:
-                return where
-        return where
+    where_normalisers = {
+        resource: WhereNormaliser(definition.get('schema', {}), app.config.get('SEARCH_WHERE_CACHE_SIZE', 256))
+        for resource, definition in app.config['DOMAIN'].iteritems()
+    }
+
+    def process_where(resource, where):
+        return where_normalisers[resource](where)
+
+    # Named projections, such as "set_results", from the show_on_* flags in each schema
+    named_projections = {
+        resource: projection_profiles(definition.get('schema', {}))
+        for resource, definition in app.config['DOMAIN'].iteritems()
+    }
+
+    def resolve_projection(resource, projection):
+        if not isinstance(projection, basestring):
+            return projection
+        try:
+            return named_projections[resource][projection]
+        except KeyError:
+            abort(400, description="Unknown projection: %s" % projection)
+
+    @app.before_request
+    def apply_named_projection():
+        # Eve expects a JSON projection in the query string, so replace a projection name
+        # with the fields it stands for before Eve parses the request
+        name = request.args.get('projection')
+        resource = (request.endpoint or '').split('|')[0]
+        if request.method == 'GET' and name and name in named_projections.get(resource, {}):
+            args = request.args.copy()
+            args['projection'] = json.dumps(named_projections[resource][name])
+            request.args = ImmutableMultiDict(args)
+
+    query_shape_recorders = {
+        resource: QueryShapeRecorder(app.config.get('QUERY_SHAPES_MAX', 1000))
+        for resource in app.config['DOMAIN']
+    }
+
+    @app.route('/search/cache', methods=['GET'])
+    def search_cache_stats(**lookup):
+        if app.search_cache is None:
+            abort(404, description="Search results are not cached")
+        return Response(response=json.dumps(app.search_cache.stats()), status=200,
+                        mimetype="application/json")
 
     def _bulk_find(resource, args):
 
+        where = process_where(resource, args.get('where'))
         find_args = {
-          'filter': process_where(args.get('where')),
-          'projection': args.get('projection'),
+          'filter': where,
+          'projection': resolve_projection(resource, args.get('projection')),
         }
         try:
             limit = max(int(args['max_results']), 0)
@@ -283,41 +715,322 @@ def create_app(settings):
             find_args['skip'] = limit*(page-1)
 
         try:
-            find_args['sort'] = [(args['sort_by'], args['sort_order'])]
-        except:
+            sort_by, sort_order = args['sort_by'], int(args['sort_order'])
+            find_args['sort'] = [(sort_by, sort_order)]
+        except (ValueError, KeyError, TypeError):
+            sort_by, sort_order = None, 1
             find_args['sort'] = None
+        if sort_by == '_id':
+            sort_by = None
+
+        # Pages are sorted with _id as a tie-breaker, so that the next page can be found
+        # with a range query starting after the last item on this one
+        hidden_fields = []
+        if limit:
+            if sort_by:
+                find_args['sort'].append(('_id', sort_order))
+            else:
+                find_args['sort'] = [('_id', sort_order)]
+            find_args['projection'], hidden_fields = include_fields(
+                find_args['projection'], ['_id', sort_by] if sort_by else ['_id'])
+
+        cursor_token = args.get('cursor')
+        if cursor_token:
+            if not limit:
+                abort(400, description="A cursor can only be used with max_results")
+            try:
+                after = keyset_filter(sort_by, sort_order, *decode_cursor(cursor_token))
+            except ValueError as e:
+                abort(400, description=str(e))
+            find_args['filter'] = {'$and': [where, after]} if where else after
+            find_args.pop('skip', None)
 
-        cursor = app.data.driver.db[resource].find(**find_args)
-        total = cursor.count()
-        pages = ((total + limit-1) // limit) if limit else 1
-        items = list(cursor)
+        total_mode = args.get('total') or app.config['DOMAIN'][resource].get('search_total', 'exact')
+        if total_mode not in TOTAL_MODES:
+            abort(400, description="total must be one of: %s" % ', '.join(TOTAL_MODES))
 
-        meta = {'max_results': limit, 'total': total, 'page': page}
+        fill_slots = resource == 'containers' and empty_slots_requested(args)
+
+        collection = app.data.driver.db[resource]
+        if request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            reject_collection_scan(resource, collection, find_args)
+            try:
+                batch_size = max(int(args['batch_size']), 1)
+            except (ValueError, KeyError):
+                batch_size = app.config.get('SEARCH_STREAM_BATCH_SIZE', 1000)
+            cursor = collection.find(**find_args).batch_size(batch_size)
+            return Response(stream_with_context(_stream_items(cursor, hidden_fields, fill_slots)),
+                            status=200,
+                            mimetype=NDJSON_MIMETYPE)
+
+        cache = app.search_cache
+        if cache is not None:
+            cache_key = json_util.dumps([find_args, total_mode, page, bool(cursor_token), fill_slots],
+                                        sort_keys=True)
+            generation = cache.generation(resource)
+            msg_json = cache.get(resource, cache_key, generation)
+            if msg_json is not None:
+                return Response(response=msg_json, status=200, mimetype="application/json")
+
+        reject_collection_scan(resource, collection, find_args)
+        record_query_shape = query_shape_recorders[resource].timer()
+
+        # Fetch one more item than requested to find out whether there is a next page
+        # without relying on the total
+        if limit:
+            find_args['limit'] = limit+1
+        max_time_ms = search_max_time_ms(resource)
+        try:
+            items = list(collection.find(**find_args).max_time_ms(max_time_ms))
+            total, exact = _count(collection, where, total_mode, max_time_ms)
+        except ExecutionTimeout:
+            search_timed_out(resource, where, find_args['sort'], max_time_ms)
+        record_query_shape(where, find_args['sort'])
+        has_next = len(items) > limit > 0
+        del items[limit or len(items):]
+
+        meta = {'max_results': limit}
+        if not cursor_token:
+            meta['page'] = page
+        if total is not None:
+            meta['total'] = total
+        if total_mode == 'estimate':
+            meta['total_estimated'] = not exact
 
         links = {}
-        if page > 1:
+        if not cursor_token and page > 1:
             links['prev'] = {'page': (page-1)}
-        if page < pages:
-            links['next'] = {'page': (page+1)}
-            links['last'] = {'page': pages}
+        if has_next and items:
+            links['next'] = {'cursor': encode_cursor(items[-1], sort_by)}
+            if not cursor_token:
+                links['next']['page'] = page+1
+                if exact:
+                    links['last'] = {'page': (total + limit-1) // limit}
 
         for item in items:
-            for k, v in item.iteritems():
-                if isinstance(v, datetime):
-                    # date_to_str converts a datetime value to the format defined in the
-                    #   configuration file
-                    item[k] = date_to_str(v)
-                if isinstance(v, unicode):
-                    item[k] = str(v)
+            _prepare_item(item, hidden_fields, fill_slots)
 
         msg = {'_items': items, '_meta': meta, '_links': links}
 
-        msg_json = json.dumps(msg, default=json_util.default)
+        msg_json = search_dumps(msg)
+        if cache is not None:
+            cache.put(resource, cache_key, msg_json, generation)
 
         return Response(response=msg_json,
                         status=200,
                         mimetype="application/json")
 
+    def search_max_time_ms(resource):
+        return app.config['DOMAIN'][resource].get('search_max_time_ms', app.config.get('SEARCH_MAX_TIME_MS'))
+
+    def search_timed_out(resource, where, sort, max_time_ms):
+        app.logger.warning("Search of %s timed out after %dms: filter shape %r, sort %r" % (
+            resource, max_time_ms, filter_shape(where), sort))
+        abort(503, description="The search did not finish within %dms" % max_time_ms)
+
+    def _count(collection, where, mode, max_time_ms=None):
+        """Return the number of documents matching where, counted as the mode asks, and
+        whether the number is exact."""
+        if mode == 'none':
+            return None, False
+        count_args = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+        if mode == 'estimate' and where:
+            # Stop counting at the cap: beyond it the total is only a lower bound
+            cap = app.config.get('SEARCH_TOTAL_ESTIMATE_CAP', 10000)
+            total = collection.count(where, limit=cap, **count_args)
+            return total, total < cap
+        # An exact count, which comes from the collection metadata when there is no filter
+        return collection.count(where, **count_args), True
+
+    # Whether each query shape and sort scans the whole collection, by resource
+    collection_scans = {resource: {} for resource in app.config['DOMAIN']}
+
+    def reject_collection_scan(resource, collection, find_args):
+        """Abort with a 400 if the search would scan the whole collection, when the collection
+        holds more than SEARCH_COLLSCAN_LIMIT documents. Each query shape is explained once."""
+        limit = app.config.get('SEARCH_COLLSCAN_LIMIT')
+        if not limit or collection.count() <= limit:
+            return
+        key = (filter_shape(find_args['filter']), tuple(find_args['sort'] or ()))
+        scans = collection_scans[resource]
+        if key not in scans:
+            if len(scans) >= app.config.get('QUERY_SHAPES_MAX', 1000):
+                scans.clear()
+            # Only plan the query: running it is the scan this check is meant to prevent
+            command = explain_command(collection.name, find_args['filter'], find_args['sort'],
+                                      find_args.get('limit'))
+            scans[key] = is_collection_scan(collection.database.command(command))
+        if scans[key]:
+            app.logger.warning("Rejected search of %s which scans the collection: filter shape %r, sort %r" % (
+                resource, key[0], find_args['sort']))
+            abort(400, description="This search would scan every document in %s; "
+                                   "filter on an indexed field" % resource)
+
+    # Serialises search responses in a single pass, formatting datetimes in the configured
+    # DATE_FORMAT as it goes, with the JSON library named by SEARCH_JSON_BACKEND
+    search_dumps = make_dumps(app.config['DATE_FORMAT'], app.config.get('SEARCH_JSON_BACKEND', 'json'))
+
+    def _prepare_item(item, hidden_fields=(), fill_slots=False):
+        if fill_slots:
+            fill_stored_empty_slots(item)
+        for field in hidden_fields:
+            pop_field(item, field)
+
+    def _stream_items(cursor, hidden_fields, fill_slots=False):
+        """Yield the documents from the cursor as newline-delimited JSON, so only one batch
+        of documents is held in memory at a time."""
+        for item in cursor:
+            _prepare_item(item, hidden_fields, fill_slots)
+            yield search_dumps(item) + '\n'
+
+    def index_advice(resource):
+        """Report the recorded search shapes for the resource with the compound index
+        recommended for each. A POST with {"create": true} creates the missing indexes,
+        if INDEX_ADVICE_CREATE is enabled."""
+        collection = app.data.driver.db[resource]
+        index_keys = [index['key'] for index in collection.index_information().itervalues()]
+        advice = query_shape_recorders[resource].report(index_keys)
+
+        if request.method == 'POST' and (request.get_json(silent=True) or {}).get('create'):
+            if not app.auth.authorized(None, resource, 'POST'):
+                return app.auth.authenticate()
+            if not app.config.get('INDEX_ADVICE_CREATE'):
+                abort(403, description="Creating indexes is not enabled")
+            for shape in advice:
+                if shape['index'] and not shape['index_exists']:
+                    collection.create_index([tuple(k) for k in shape['index']], background=True)
+                    collection_scans[resource].clear()
+                    shape['index_exists'] = True
+                    shape['index_created'] = True
+
+        return Response(response=json.dumps({'_items': advice}), status=200, mimetype="application/json")
+
+    @app.route('/materials/search/index_advice', methods=['GET', 'POST'])
+    def materials_index_advice(**lookup):
+        return index_advice('materials')
+
+    @app.route('/containers/search/index_advice', methods=['GET', 'POST'])
+    def containers_index_advice(**lookup):
+        return index_advice('containers')
+
+    def facets(resource, args):
+        """Count the documents matching the search's where with each value of the requested
+        searchable fields, in a single aggregation."""
+        fields = args.get('fields')
+        if not isinstance(fields, list) or not fields:
+            abort(422)
+        unknown = set(fields) - searchable_fields(app.config['DOMAIN'][resource]['schema'])
+        if unknown:
+            abort(400, description="Fields are not searchable: %s" % ', '.join(sorted(unknown)))
+        try:
+            max_values = max(int(args['max_values']), 1)
+        except (ValueError, KeyError, TypeError):
+            max_values = None
+
+        where = process_where(resource, args.get('where'))
+        pipeline = facet_pipeline(where, fields, max_values)
+        max_time_ms = search_max_time_ms(resource)
+        aggregate_args = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+        try:
+            result = next(app.data.driver.db[resource].aggregate(pipeline, **aggregate_args))
+        except ExecutionTimeout:
+            search_timed_out(resource, where, None, max_time_ms)
+
+        counts = {field: [{'value': group['_id'], 'count': group['count']} for group in groups]
+                  for field, groups in result.iteritems()}
+        return Response(response=search_dumps(counts), status=200, mimetype="application/json")
+
+    @app.route('/materials/facets', methods=['POST'])
+    def material_facets(**lookup):
+        return facets('materials', request.json)
+
+    def batch_get(resource, args):
+        """Return the documents with the given ids, in the order given, looked up in chunks
+        concurrently, with the ids that were not found. With Accept: application/x-ndjson the
+        documents are streamed, and each missing id is a line of {"_missing": id}."""
+        ids = args.get('ids') if isinstance(args, dict) else None
+        if not is_id_list(ids):
+            abort(422)
+        projection = resolve_projection(resource, args.get('projection'))
+        projection, hidden_fields = include_fields(projection, ['_id'])
+        chunks = find_in_order(app.data.driver.db[resource], ids, projection,
+                               app.config.get('LOOKUP_CHUNK_SIZE', 1000), get_lookup_pool())
+        fill_slots = resource == 'containers' and empty_slots_requested(args)
+
+        if request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            return Response(_stream_batch(chunks, hidden_fields, fill_slots), status=200,
+                            mimetype=NDJSON_MIMETYPE)
+
+        items, missing = [], []
+        for chunk in chunks:
+            for _id, doc in chunk:
+                if doc is None:
+                    missing.append(_id)
+                else:
+                    _prepare_item(doc, hidden_fields, fill_slots)
+                    items.append(doc)
+        msg = {'_items': items, '_missing': missing}
+        return Response(response=search_dumps(msg), status=200, mimetype="application/json")
+
+    def _stream_batch(chunks, hidden_fields, fill_slots=False):
+        for chunk in chunks:
+            for _id, doc in chunk:
+                if doc is None:
+                    yield search_dumps({'_missing': _id}) + '\n'
+                else:
+                    _prepare_item(doc, hidden_fields, fill_slots)
+                    yield search_dumps(doc) + '\n'
+
+    @app.route('/materials/batch', methods=['POST'])
+    def batch_get_materials(**lookup):
+        return batch_get('materials', request.json)
+
+    @app.route('/containers/batch', methods=['POST'])
+    def batch_get_containers(**lookup):
+        return batch_get('containers', request.json)
+
+    @app.route('/materials/bulk', methods=['PATCH'])
+    def bulk_update_materials(**lookup):
+        """Set fields of every material matching a search's where with a single update_many.
+        The $set is validated once, like a PATCH. With dry_run, only the number of materials
+        that would be changed is returned."""
+        if not app.auth.authorized(None, 'materials', 'PATCH'):
+            return app.auth.authenticate()
+
+        body = request.json
+        if not isinstance(body, dict) or not isinstance(body.get('where'), dict) \
+                or not isinstance(body.get('$set'), dict) or not body['$set']:
+            abort(422)
+        if not body['where']:
+            abort(422, description="A where is needed to choose the materials to update")
+
+        schema = app.config['DOMAIN']['materials']['schema']
+        unknown = [field for field in body['$set'] if field.startswith('_') or field not in schema]
+        if unknown:
+            response_body = json.dumps({"_status": "ERR",
+                                        "_issues": {field: "unknown field" for field in unknown}})
+            return Response(status=422, response=response_body, mimetype="application/json")
+
+        changes = parse(body['$set'], 'materials')
+        validator = app.validator(schema, resource='materials')
+        if not validator.validate_update(changes, None):
+            response_body = json.dumps({"_status": "ERR", "_issues": validator.errors})
+            return Response(status=422, response=response_body, mimetype="application/json")
+
+        where = process_where('materials', body['where'])
+        collection = app.data.driver.db.materials
+        if body.get('dry_run'):
+            response_body = json.dumps({"_status": "OK", "dry_run": True, "matched": collection.count(where)})
+            return Response(status=200, response=response_body, mimetype="application/json")
+
+        changes[app.config['LAST_UPDATED']] = datetime.utcnow().replace(microsecond=0)
+        result = collection.update_many(where, {'$set': changes, '$unset': {app.config['ETAG']: ''}})
+        invalidate_search_cache('materials')
+
+        response_body = json.dumps({"_status": "OK", "matched": result.matched_count,
+                                    "modified": result.modified_count})
+        return Response(status=200, response=response_body, mimetype="application/json")
+
     @app.route('/materials/search', methods=['POST'])
     def bulk_find_materials(**lookup):
         return _bulk_find('materials', request.json)
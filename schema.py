@@ -16,6 +16,90 @@ ITEM_URL = 'regex("[a-f0-9]{8}-?[a-f0-9]{4}-?4[a-f0-9]{3}-?[89ab][a-f0-9]{3}-?[a
 
 BANDWIDTH_SAVER = False
 
+# Number of AKER barcode numbers each worker reserves from the counters collection at a
+# time. 0 reserves exactly as many as each request needs. Any larger value cuts contention
+# on the counter document, but numbers left unused when a worker stops are skipped.
+BARCODE_BLOCK_SIZE = 0
+
+# If True, containers are stored with only their occupied slots. The empty slots are
+# rebuilt from the container's geometry when a GET request passes ?empty_slots=1, or a
+# search or batch request passes "empty_slots": true.
+SPARSE_SLOTS = False
+
+# If True, container slots are validated together in a single pass rather than by
+# running the Cerberus schema for each slot. Both report the same errors.
+FAST_SLOT_VALIDATION = True
+
+# Number of documents fetched from MongoDB at a time when search results are streamed
+# as newline-delimited JSON (Accept: application/x-ndjson). Requests can override it
+# with a batch_size argument.
+SEARCH_STREAM_BATCH_SIZE = 1000
+
+# Searches report their total as each resource's 'search_total' says, unless the request
+# passes a total argument: 'exact' counts every match, 'estimate' stops counting at
+# SEARCH_TOTAL_ESTIMATE_CAP, and 'none' does not count at all.
+SEARCH_TOTAL_ESTIMATE_CAP = 10000
+
+# Number of distinct search filters, per resource, whose prepared form (with date strings
+# converted for the schema's datetime fields) is remembered
+SEARCH_WHERE_CACHE_SIZE = 256
+
+# JSON library used to serialise search results: 'json' (the standard library), or
+# 'simplejson' or 'rapidjson' if they are installed
+SEARCH_JSON_BACKEND = 'json'
+
+# Number of search responses each worker caches (0 disables the cache). A cached response
+# is served for up to SEARCH_CACHE_TTL seconds, until the resource is written to. With
+# SEARCH_CACHE_SHARED, writes are counted in MongoDB so that they invalidate the caches of
+# every worker, at the cost of a small query per search. GET /search/cache reports the
+# cache's hits, misses and evictions.
+SEARCH_CACHE_SIZE = 0
+SEARCH_CACHE_TTL = 30
+SEARCH_CACHE_SHARED = False
+
+# Time in milliseconds a search may spend in MongoDB before it is stopped with a 503,
+# unless the resource sets its own 'search_max_time_ms'. 0 means no limit.
+SEARCH_MAX_TIME_MS = 30000
+
+# If a collection holds more than SEARCH_COLLSCAN_LIMIT documents, searches whose query
+# plan scans the whole collection are rejected with a 400 (0 allows them). Each query
+# shape is explained once.
+SEARCH_COLLSCAN_LIMIT = 0
+
+# Each worker records the shape (fields, operators and sort) and latency of the searches
+# it runs, for up to QUERY_SHAPES_MAX shapes per resource. GET <resource>/search/index_advice
+# reports them with the compound index recommended for each. If INDEX_ADVICE_CREATE is
+# True, a POST there with {"create": true} creates the missing indexes.
+QUERY_SHAPES_MAX = 1000
+INDEX_ADVICE_CREATE = False
+
+# Largest number of ids sent to MongoDB in a single $in when looking documents up by id,
+# e.g. to validate materials or verify their ownership. Longer lists are looked up in chunks.
+LOOKUP_CHUNK_SIZE = 1000
+
+# Number of threads each worker uses to look up the chunks of a long list of ids, e.g. in
+# /materials/validate. 1 looks the chunks up one after another.
+LOOKUP_THREADS = 4
+
+# If True, each worker keeps a Bloom filter of the material ids, so that /materials/validate
+# and /materials/verify_ownership can tell that most unknown ids do not exist without a
+# query. It is filled at startup, and sized for MATERIAL_ID_FILTER_CAPACITY ids with a
+# MATERIAL_ID_FILTER_ERROR_RATE chance of failing to rule out an unknown id (about 1.8MB
+# for a million ids). Once it holds more ids than that, a larger filter is built in the
+# background. GET /materials/id_filter reports its size and false positive rate.
+#
+# Materials are also inserted by other workers, so a lookup which finds ids that the filter
+# rules out first queries for the materials created since the filter last synced. Setting
+# MATERIAL_ID_FILTER_SYNC_INTERVAL makes it sync at most once in that many seconds, at the
+# risk of reporting that a material inserted by another worker in that time is missing.
+MATERIAL_ID_FILTER = False
+MATERIAL_ID_FILTER_CAPACITY = 1000000
+MATERIAL_ID_FILTER_ERROR_RATE = 0.001
+MATERIAL_ID_FILTER_SYNC_INTERVAL = 0
+
+# Number of lines of an import that are validated and inserted together
+IMPORT_BATCH_SIZE = 1000
+
 SWAGGER_INFO = {
   'title': 'Materials Service',
   'description': 'A RESTful web service for storing material data',
@@ -277,6 +361,7 @@ container_schema = {
 DOMAIN = {
   'materials': {
     'schema': material_schema,
+    'search_total': 'exact',
     'mongo_indexes': {
         'Supplier Name Index': [('supplier_name', 1)],
         'Tissue Type Index': [('tissue_type', 1)],
@@ -291,10 +376,15 @@ DOMAIN = {
         'Date of Receipt Index': [('date_of_receipt', 1)],
         'Concentration Index': [('concentration', 1)],
         'Volume Index': [('volume', 1)],
-        'Amount Index': [('amount', 1)]
+        'Amount Index': [('amount', 1)],
+        'Created Index': [('_created', 1)]
     }
   },
   'containers': {
-    'schema': container_schema
+    'schema': container_schema,
+    'search_total': 'exact',
+    'mongo_indexes': {
+        'Slot Material Index': [('slots.material', 1)]
+    }
   }
 }
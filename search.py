@@ -0,0 +1,169 @@
+import base64
+import binascii
+import json
+import threading
+from collections import OrderedDict
+
+from bson import SON, json_util
+from eve.utils import str_to_date
+
+
+def get_field(document, path):
+    """Return the value at a dotted path in a document, or None if there is none."""
+    for key in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def pop_field(document, path):
+    """Remove the value at a dotted path from a document, and any embedded documents that
+    are left empty."""
+    key, _, rest = path.partition('.')
+    if not rest:
+        document.pop(key, None)
+        return
+    embedded = document.get(key)
+    if isinstance(embedded, dict):
+        pop_field(embedded, rest)
+        if not embedded:
+            del document[key]
+
+
+def encode_cursor(item, sort_by):
+    """Return an opaque token for the position just after the given item, in results sorted
+    by sort_by (or None) and then _id."""
+    key = [get_field(item, sort_by) if sort_by else None, item['_id']]
+    return base64.urlsafe_b64encode(json_util.dumps(key))
+
+
+def decode_cursor(token):
+    """Return the (sort value, _id) pair encoded in a cursor token.
+    Raises a ValueError if the token is not valid."""
+    try:
+        value, _id = json_util.loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError("Invalid cursor: %r" % token)
+    return value, _id
+
+
+def keyset_filter(sort_by, sort_order, value, _id):
+    """Return a filter for the results that come after the (value, _id) position, when sorted
+    by sort_by in the given order (1 or -1) and then by _id in the same order."""
+    after = '$gt' if sort_order > 0 else '$lt'
+    if not sort_by:
+        return {'_id': {after: _id}}
+    same_value = {sort_by: value, '_id': {after: _id}}
+    # Missing and null values sort before every other value, and range operators
+    # never match them
+    if value is None:
+        if sort_order > 0:
+            return {'$or': [same_value, {sort_by: {'$ne': None}}]}
+        return same_value
+    clauses = [{sort_by: {after: value}}, same_value]
+    if sort_order < 0:
+        clauses.append({sort_by: None})
+    return {'$or': clauses}
+
+
+def include_fields(projection, fields):
+    """Return a copy of the projection which also returns the given fields, and a list of
+    the fields that had to be added, which should be removed from the results."""
+    if not projection:
+        return projection, []
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    projection = dict(projection)
+    inclusive = any(v for k, v in projection.iteritems() if k != '_id')
+    added = []
+    for field in fields:
+        if field == '_id' or not inclusive:
+            if field in projection and not projection[field]:
+                del projection[field]
+                added.append(field)
+        elif not projection.get(field):
+            projection[field] = 1
+            added.append(field)
+    return projection or None, added
+
+
+def projection_profiles(schema, prefix='show_on_'):
+    """Return the named projections for a resource schema: each show_on_<name> flag in
+    the schema gives a projection <name> of the fields with that flag."""
+    profiles = {}
+    for field, definition in schema.iteritems():
+        for rule, value in definition.iteritems():
+            if rule.startswith(prefix) and value:
+                profiles.setdefault(rule[len(prefix):], {})[field] = 1
+    return profiles
+
+
+def searchable_fields(schema):
+    """Return the names of the fields a resource schema marks as searchable."""
+    return frozenset(field for field, definition in schema.iteritems() if definition.get('searchable'))
+
+
+def facet_pipeline(where, fields, max_values=None):
+    """Return an aggregation pipeline which counts the documents matching where with each
+    value of each of the given fields, most common first, in a single $facet stage."""
+    facets = {}
+    for field in fields:
+        stages = [{'$group': {'_id': '$' + field, 'count': {'$sum': 1}}},
+                  {'$sort': SON([('count', -1), ('_id', 1)])}]
+        if max_values:
+            stages.append({'$limit': max_values})
+        facets[field] = stages
+    return [{'$match': where or {}}, {'$facet': facets}]
+
+
+def date_fields(schema):
+    """Return the names of the datetime fields in a resource schema."""
+    return frozenset(field for field, definition in schema.iteritems()
+                     if definition.get('type') == 'datetime')
+
+
+def convert_dates(where, fields, in_date_value=False):
+    """Return a copy of the where filter with the date strings given for the named fields
+    (at any depth, including inside operators) converted to datetimes."""
+    if not where:
+        return where
+    if isinstance(where, dict):
+        return {k: convert_dates(v, fields, in_date_value or k in fields) for k, v in where.iteritems()}
+    if isinstance(where, (list, tuple)):
+        return [convert_dates(x, fields, in_date_value) for x in where]
+    if in_date_value and isinstance(where, basestring):
+        try:
+            return str_to_date(where)
+        except ValueError:
+            return where
+    return where
+
+
+class WhereNormaliser(object):
+    """Prepares where filters for a resource, remembering the most recently used ones by
+    their canonical JSON so that repeated queries are not converted again.
+    The filters returned are shared, and must not be changed.
+    """
+
+    def __init__(self, schema, cache_size=256):
+        self.date_fields = date_fields(schema)
+        self.cache_size = cache_size
+        self._filters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, where):
+        if not where or not self.cache_size:
+            return convert_dates(where, self.date_fields)
+        key = json.dumps(where, sort_keys=True)
+        with self._lock:
+            prepared = self._filters.pop(key, None)
+            if prepared is not None:
+                self._filters[key] = prepared
+                return prepared
+        prepared = convert_dates(where, self.date_fields)
+        with self._lock:
+            self._filters[key] = prepared
+            if len(self._filters) > self.cache_size:
+                self._filters.popitem(last=False)
+        return prepared
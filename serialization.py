@@ -0,0 +1,52 @@
+import json
+from datetime import datetime
+from uuid import UUID
+
+from bson import json_util
+
+
+def make_default(date_format):
+    """Return a JSON default function which formats datetimes with date_format (as Eve does)
+    and handles UUIDs and the other BSON types."""
+    def default(obj):
+        if isinstance(obj, datetime):
+            return obj.strftime(date_format)
+        if isinstance(obj, UUID):
+            return str(obj)
+        return json_util.default(obj)
+    return default
+
+
+def _json_backend(default):
+    return lambda obj: json.dumps(obj, default=default)
+
+
+def _simplejson_backend(default):
+    import simplejson
+    return lambda obj: simplejson.dumps(obj, default=default)
+
+
+def _rapidjson_backend(default):
+    import rapidjson
+    return lambda obj: rapidjson.dumps(obj, default=default)
+
+
+# Functions which return a dumps function using the named JSON library and the given
+# default function
+JSON_BACKENDS = {
+    'json': _json_backend,
+    'simplejson': _simplejson_backend,
+    'rapidjson': _rapidjson_backend,
+}
+
+
+def make_dumps(date_format, backend='json'):
+    """Return a function which serialises a document, or a whole response, to JSON in a
+    single pass, using the named backend. Raises a ValueError if the backend is unknown
+    or its library is not installed."""
+    try:
+        return JSON_BACKENDS[backend](make_default(date_format))
+    except KeyError:
+        raise ValueError("Unknown JSON backend: %r" % backend)
+    except ImportError as e:
+        raise ValueError("JSON backend %r is not available: %s" % (backend, e))
@@ -0,0 +1,72 @@
+from pymongo import UpdateOne
+
+from addresser import get_addresser
+
+
+def container_addresser(container):
+    """Return an addresser for the geometry described by the given container."""
+    return get_addresser(container['num_of_rows'],
+                         container['num_of_cols'],
+                         bool(container.get('row_is_alpha')),
+                         bool(container.get('col_is_alpha')))
+
+
+def is_empty_slot(slot):
+    """Does the slot hold nothing but its address?"""
+    return slot.get('material') is None
+
+
+def fill_empty_slots(container):
+    """Add an empty slot for every address in the container's geometry that has no slot,
+    so the slots are listed in address order, as a container stored with all of its slots
+    would list them. Any slot whose address is outside the geometry is kept at the end.
+    """
+    addresser = container_addresser(container)
+    definedslots = {slot['address']: slot for slot in container.get('slots') or []}
+    slots = [definedslots.pop(address, None) or {'address': address} for address in addresser]
+    slots.extend(slot for slot in container.get('slots') or [] if slot['address'] in definedslots)
+    container['slots'] = slots
+
+
+def remove_empty_slots(container):
+    """Remove the slots that hold no material, so only occupied slots are stored."""
+    slots = container.get('slots')
+    if slots:
+        container['slots'] = [slot for slot in slots if not is_empty_slot(slot)]
+
+
+def slot_updates(container_id, address, material, sparse=False):
+    """Return the update operations which put the given material (or nothing, if it is
+    None) in the slot at the given address of a container, whether or not the slot is
+    already stored.
+    """
+    in_slot = {'_id': container_id, 'slots.address': address}
+    if material is None:
+        if sparse:
+            return [UpdateOne({'_id': container_id}, {'$pull': {'slots': {'address': address}}})]
+        return [UpdateOne(in_slot, {'$unset': {'slots.$.material': ''}})]
+    return [
+        UpdateOne(in_slot, {'$set': {'slots.$.material': material}}),
+        UpdateOne({'_id': container_id, 'slots.address': {'$ne': address}},
+                  {'$push': {'slots': {'address': address, 'material': material}}}),
+    ]
+
+
+def find_material_locations(containers, material_ids):
+    """Return a dict mapping each of the given material ids which is in a slot of one of the
+    containers to its location: a dict of container_id, barcode and address.
+    """
+    pipeline = [
+        {'$match': {'slots.material': {'$in': material_ids}}},
+        {'$project': {'barcode': 1, 'slots.address': 1, 'slots.material': 1}},
+        {'$unwind': '$slots'},
+        {'$match': {'slots.material': {'$in': material_ids}}},
+    ]
+    return {
+        doc['slots']['material']: {
+            'container_id': doc['_id'],
+            'barcode': doc.get('barcode'),
+            'address': doc['slots']['address'],
+        }
+        for doc in containers.aggregate(pipeline)
+    }
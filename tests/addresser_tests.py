@@ -1,6 +1,7 @@
 import unittest
 
-from addresser import Addresser
+import addresser as addresser_module
+from addresser import Addresser, TabulatedAddresser, get_addresser
 
 
 class AddresserTests(unittest.TestCase):
@@ -25,3 +26,38 @@ class AddresserTests(unittest.TestCase):
 
     def test_addresser_numeric(self):
         self._test_addresser(Addresser(2, 3, False, False), map(str, xrange(1, 7)))
+
+    def test_tabulated_addresser_row_alpha(self):
+        self._test_addresser(TabulatedAddresser(2, 3, True, False), "A:1 A:2 A:3 B:1 B:2 B:3".split())
+
+    def test_tabulated_addresser_numeric(self):
+        self._test_addresser(TabulatedAddresser(2, 3, False, False), map(str, xrange(1, 7)))
+
+    def test_tabulated_addresser_errors_match_addresser(self):
+        tabulated = TabulatedAddresser(8, 12, True, False)
+        plain = Addresser(8, 12, True, False)
+        for address in ['1:A', 'I:12', 'H:13', 'H:0', 'Z:99', 'nonsense']:
+            with self.assertRaises(ValueError) as expected:
+                plain.index(address)
+            with self.assertRaises(ValueError) as actual:
+                tabulated.index(address)
+            self.assertEqual(actual.exception.message, expected.exception.message)
+        self.assertEqual(tabulated.index(u'H:12'), 95)
+        self.assertRaises(TypeError, tabulated.index, 5)
+        self.assertRaises(IndexError, tabulated.index_to_address, 96)
+
+    def test_get_addresser_shares_instances(self):
+        addresser = get_addresser(8, 12, True, False)
+        self.assertIs(get_addresser(8, 12, 1, 0), addresser)
+        self.assertIsNot(get_addresser(8, 12, False, True), addresser)
+        self.assertIsInstance(addresser, TabulatedAddresser)
+
+    def test_get_addresser_does_not_tabulate_huge_geometries(self):
+        addresser = get_addresser(9999, 9999, False, False)
+        self.assertNotIsInstance(addresser, TabulatedAddresser)
+        self.assertEqual(addresser.index('99980001'), 99980000)
+
+    def test_get_addresser_cache_is_bounded(self):
+        for rows in xrange(1, addresser_module.ADDRESSER_CACHE_SIZE + 10):
+            get_addresser(rows, 3, False, False)
+        self.assertEqual(len(addresser_module._addressers), addresser_module.ADDRESSER_CACHE_SIZE)
@@ -0,0 +1,45 @@
+from flask import current_app
+
+from tests import ServiceTestBase
+from barcodes import BarcodeAllocator
+
+
+class TestBarcodeAllocator(ServiceTestBase):
+
+    def setUp(self):
+        super(TestBarcodeAllocator, self).setUp()
+        with self.app.app_context():
+            self.counters = current_app.data.driver.db.counters
+            self.counters.remove({'_id': 'barcode_test'})
+
+    def tearDown(self):
+        with self.app.app_context():
+            self.counters.remove({'_id': 'barcode_test'})
+        super(TestBarcodeAllocator, self).tearDown()
+
+    def test_reserve_takes_whole_range_in_one_update(self):
+        allocator = BarcodeAllocator(counter_id='barcode_test')
+        with self.app.app_context():
+            self.assertEqual(allocator.allocate(self.counters, 3), [1, 2, 3])
+            self.assertEqual(allocator.allocate(self.counters, 2), [4, 5])
+            self.assertEqual(self.counters.find_one({'_id': 'barcode_test'})['seq'], 5)
+
+    def test_block_mode_serves_from_reserved_block(self):
+        allocator = BarcodeAllocator(block_size=10, counter_id='barcode_test')
+        with self.app.app_context():
+            self.assertEqual(allocator.allocate(self.counters, 3), [1, 2, 3])
+            self.assertEqual(self.counters.find_one({'_id': 'barcode_test'})['seq'], 10)
+            self.assertEqual(allocator.allocate(self.counters, 6), [4, 5, 6, 7, 8, 9])
+            self.assertEqual(allocator.allocate(self.counters, 3), [10, 11, 12])
+            self.assertEqual(self.counters.find_one({'_id': 'barcode_test'})['seq'], 20)
+
+    def test_block_mode_reserves_large_requests_at_once(self):
+        allocator = BarcodeAllocator(block_size=4, counter_id='barcode_test')
+        with self.app.app_context():
+            self.assertEqual(allocator.allocate(self.counters, 6), range(1, 7))
+            self.assertEqual(allocator.allocate(self.counters, 1), [7])
+
+    def test_barcodes_have_aker_prefix(self):
+        allocator = BarcodeAllocator(counter_id='barcode_test')
+        with self.app.app_context():
+            self.assertEqual(allocator.barcodes(self.counters, 2), ['AKER-1', 'AKER-2'])
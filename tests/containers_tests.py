@@ -2,6 +2,7 @@ import utils
 
 from tests import ServiceTestBase, valid_material_params
 from itertools import izip
+import uuid
 import pdb
 
 class TestContainers(ServiceTestBase):
@@ -117,6 +118,17 @@ class TestContainers(ServiceTestBase):
     self.assertTrue(bc2.startswith('AKER-'))
     self.assertNotEqual(bc1, bc2)
 
+  def test_bulk_created_containers_get_consecutive_barcodes(self):
+    data = [valid_container_params(), valid_container_params({ 'barcode': 'xxxxxxx' }), valid_container_params()]
+
+    response, status = self.post('/containers', data=data)
+
+    self.assert201(status)
+    barcodes = [item['barcode'] for item in response['_items']]
+    self.assertEqual(barcodes[1], 'xxxxxxx')
+    first, last = (int(bc[len('AKER-'):]) for bc in (barcodes[0], barcodes[2]))
+    self.assertEqual(last, first + 1)
+
   def test_cannot_supply_aker_barcode(self):
     data = valid_container_params()
 
@@ -558,6 +570,46 @@ class TestContainers(ServiceTestBase):
       else:
         self.assertEqual(slot.get('material'), None)
 
+  def test_sparse_slots_stores_only_occupied_slots(self):
+    self.app.config['SPARSE_SLOTS'] = True
+    materials_response, status = self.post('/materials', valid_material_params())
+    material_id = materials_response['_id']
+    data = valid_container_params({
+      'num_of_rows': 2,
+      'num_of_cols': 3,
+      'slots': [
+        { 'address': 'A:2', 'material': material_id },
+        { 'address': 'B:1' },
+      ]
+    })
+    container, status = self.post('/containers', data=data)
+    self.assert201(status)
+
+    response, status = self.get('containers/%s'%container['_id'])
+    self.assert200(status)
+    self.assertEqual(response['slots'], [{ 'address': 'A:2', 'material': material_id }])
+
+    response, status = self.get('containers/%s?empty_slots=1'%container['_id'])
+    self.assert200(status)
+    slots = response['slots']
+    self.assertEqual([slot['address'] for slot in slots], 'A:1 A:2 A:3 B:1 B:2 B:3'.split())
+    self.assertEqual([slot.get('material') for slot in slots], [None, material_id, None, None, None, None])
+
+  def test_sparse_slots_removes_empty_slots_on_update(self):
+    self.app.config['SPARSE_SLOTS'] = True
+    materials_response, status = self.post('/materials', valid_material_params())
+    material_id = materials_response['_id']
+    container, status = self.post('/containers', data=valid_container_params())
+    self.assert201(status)
+
+    update = { 'slots': [{ 'address': 'A:1' }, { 'address': 'A:2', 'material': material_id }] }
+    _, status = self.patch('/containers/%s'%container['_id'], data=update)
+    self.assert200(status)
+
+    response, status = self.get('containers?empty_slots=0')
+    self.assert200(status)
+    self.assertEqual(response['_items'][0]['slots'], [{ 'address': 'A:2', 'material': material_id }])
+
   def test_update_plate_without_giving_barcode(self):
     data = valid_container_params()
     response, status = self.post('/containers', data=data)
@@ -603,6 +655,132 @@ class TestContainers(ServiceTestBase):
     self.assertEqual(len(r['_items']), 1)
 
 
+  def test_get_slot(self):
+    materials_response, status = self.post('/materials', valid_material_params())
+    material_id = materials_response['_id']
+    container, _ = self.post('/containers', data=valid_container_params({
+      'slots': [{ 'address': 'B:2', 'material': material_id }]
+    }))
+
+    response, status = self.get('containers/%s/slots/B:2'%container['_id'])
+    self.assert200(status)
+    self.assertEqual(response, { 'address': 'B:2', 'material': material_id })
+
+    response, status = self.get('containers/%s/slots/C:3'%container['_id'])
+    self.assert200(status)
+    self.assertEqual(response, { 'address': 'C:3' })
+
+    _, status = self.get('containers/%s/slots/Z:3'%container['_id'])
+    self.assert404(status)
+
+  def test_update_slot(self):
+    materials_response, status = self.post('/materials', valid_material_params())
+    material_id = materials_response['_id']
+    container, _ = self.post('/containers', data=valid_container_params())
+
+    response, status = self.patch('/containers/%s/slots/C:3'%container['_id'], data={ 'material': material_id })
+    self.assert200(status)
+
+    response, status = self.get('containers/%s'%container['_id'])
+    self.assertEqual(len(response['slots']), 96)
+    filled = [slot for slot in response['slots'] if slot.get('material')]
+    self.assertEqual(filled, [{ 'address': 'C:3', 'material': material_id }])
+
+    response, status = self.patch('/containers/%s/slots/C:3'%container['_id'], data={ 'material': None })
+    self.assert200(status)
+    response, status = self.get('containers/%s'%container['_id'])
+    self.assertEqual(len(response['slots']), 96)
+    self.assertFalse(any(slot.get('material') for slot in response['slots']))
+
+  def test_update_slots_batch(self):
+    m1, _ = self.post('/materials', valid_material_params())
+    m2, _ = self.post('/materials', valid_material_params())
+    container, _ = self.post('/containers', data=valid_container_params())
+
+    data = [{ 'address': 'A:1', 'material': m1['_id'] }, { 'address': 'H:12', 'material': m2['_id'] }]
+    response, status = self.patch('/containers/%s/slots'%container['_id'], data=data)
+    self.assert200(status)
+
+    response, status = self.get('containers/%s'%container['_id'])
+    filled = sorted(slot for slot in response['slots'] if slot.get('material'))
+    self.assertEqual(filled, sorted(data))
+
+  def test_update_slots_batch_in_sparse_container(self):
+    self.app.config['SPARSE_SLOTS'] = True
+    m1, _ = self.post('/materials', valid_material_params())
+    container, _ = self.post('/containers', data=valid_container_params())
+
+    data = [{ 'address': 'A:1', 'material': m1['_id'] }]
+    response, status = self.patch('/containers/%s/slots'%container['_id'], data=data)
+    self.assert200(status)
+    response, status = self.get('containers/%s'%container['_id'])
+    self.assertEqual(response['slots'], data)
+
+    response, status = self.patch('/containers/%s/slots/A:1'%container['_id'], data={ 'material': None })
+    self.assert200(status)
+    response, status = self.get('containers/%s'%container['_id'])
+    self.assertEqual(response['slots'], [])
+
+  def test_update_slots_batch_invalid(self):
+    container, _ = self.post('/containers', data=valid_container_params())
+    data = [{ 'address': 'Z:1', 'material': str(uuid.uuid4()) }, { 'address': 'A:1', 'material': 'nonsense' }]
+    response, status = self.patch('/containers/%s/slots'%container['_id'], data=data)
+    self.assertValidationErrorStatus(status)
+    self.assertEqual(response['_issues']['slots']['0']['address'], "Row out of range: 'Z:1'")
+    self.assertIn('must exist', response['_issues']['slots']['0']['material'])
+    self.assertIn('UUID', response['_issues']['slots']['1']['material'])
+
+    data = [{ 'address': 'A:1', 'material': 5 }]
+    response, status = self.patch('/containers/%s/slots'%container['_id'], data=data)
+    self.assertValidationErrorStatus(status)
+    self.assertIn('UUID', response['_issues']['slots']['0']['material'])
+
+  def test_update_slots_401_when_invalid_jwt(self):
+    container, _ = self.post('/containers', data=valid_container_params())
+    headers = [('X-Authorisation', 'jibberish.jwt.rubbish')]
+    _, status = self.patch('/containers/%s/slots/A:1'%container['_id'], data={ 'material': None }, headers=headers)
+    self.assert401(status)
+    data = [{ 'address': 'A:1', 'material': None }]
+    _, status = self.patch('/containers/%s/slots'%container['_id'], data=data, headers=headers)
+    self.assert401(status)
+
+  def test_update_slot_of_missing_container(self):
+    _, status = self.patch('/containers/%s/slots/A:1'%uuid.uuid4(), data={ 'material': None })
+    self.assert404(status)
+
+  def test_batch_get_containers(self):
+    containers = [self.post('/containers', data=valid_container_params())[0]['_id'] for _ in xrange(2)]
+    unknown = str(uuid.uuid4())
+    response, status = self.post('/containers/batch', data={ 'ids': [containers[1], unknown, containers[0]] })
+    self.assert200(status)
+    self.assertEqual([c['_id'] for c in response['_items']], [containers[1], containers[0]])
+    self.assertEqual(response['_missing'], [unknown])
+
+  def test_search_and_batch_get_fill_empty_slots(self):
+    self.app.config['SPARSE_SLOTS'] = True
+    materials_response, status = self.post('/materials', valid_material_params())
+    material_id = materials_response['_id']
+    data = valid_container_params({
+      'num_of_rows': 1,
+      'num_of_cols': 3,
+      'slots': [{ 'address': 'A:2', 'material': material_id }]
+    })
+    container, status = self.post('/containers', data=data)
+    self.assert201(status)
+    filled = [{ 'address': 'A:1' }, { 'address': 'A:2', 'material': material_id }, { 'address': 'A:3' }]
+
+    response, status = self.post('/containers/search', data={ 'where': {}, 'empty_slots': True })
+    self.assert200(status)
+    self.assertEqual(response['_items'][0]['slots'], filled)
+
+    response, status = self.post('/containers/search', data={ 'where': {} })
+    self.assert200(status)
+    self.assertEqual(response['_items'][0]['slots'], [{ 'address': 'A:2', 'material': material_id }])
+
+    response, status = self.post('/containers/batch', data={ 'ids': [container['_id']], 'empty_slots': 1 })
+    self.assert200(status)
+    self.assertEqual(response['_items'][0]['slots'], filled)
+
 # helper
 
 def valid_container_params(changes=None):
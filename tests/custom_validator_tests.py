@@ -0,0 +1,92 @@
+import unittest
+
+from flask import Flask
+
+from custom_validator import CustomValidator, collect_relation_values
+from schema import container_schema, material_schema
+
+
+class SlotValidationTests(unittest.TestCase):
+    """Check that the single-pass slot validation reports the same errors as validating
+    each slot with its schema."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def _errors(self, document, fast):
+        self.app.config['FAST_SLOT_VALIDATION'] = fast
+        with self.app.app_context():
+            validator = CustomValidator(container_schema)
+            validator.validate(document)
+            return validator.errors
+
+    def _assert_same_errors(self, slots, **geometry):
+        document = {'num_of_rows': 8, 'num_of_cols': 12, 'row_is_alpha': True, 'col_is_alpha': False,
+                    'slots': slots}
+        document.update(geometry)
+        errors = self._errors(document, True)
+        self.assertEqual(errors, self._errors(document, False))
+        return errors
+
+    def test_valid_slots(self):
+        self.assertEqual(self._assert_same_errors([{'address': 'A:1'}, {'address': 'H:12'}]), {})
+
+    def test_invalid_addresses(self):
+        errors = self._assert_same_errors([{'address': 'A:1'}, {'address': '1:A'}, {'address': 'I:12'}])
+        self.assertEqual(errors['slots'], {1: {'address': "Invalid address format: '1:A'"},
+                                           2: {'address': "Row out of range: 'I:12'"}})
+
+    def test_numeric_addresses(self):
+        errors = self._assert_same_errors([{'address': '0'}, {'address': '97'}, {'address': '96'}],
+                                          row_is_alpha=False)
+        self.assertEqual(errors['slots'], {0: {'address': "Address out of range: '0'"},
+                                           1: {'address': "Address out of range: '97'"}})
+
+    def test_duplicate_addresses(self):
+        errors = self._assert_same_errors([{'address': 'A:1'}, {'address': 'A:1'}, {'address': 'B:1'},
+                                           {'address': 'B:1'}, {'address': 'C:1'}])
+        self.assertEqual(sorted(errors['slots']), ['Address A:1 is a duplicate', 'Address B:1 is a duplicate'])
+
+    def test_invalid_and_duplicate_addresses(self):
+        self._assert_same_errors([{'address': 'Z:1'}, {'address': 'Z:1'}])
+
+    def test_invalid_material_uuid(self):
+        errors = self._assert_same_errors([{'address': 'A:1', 'material': 'not-a-uuid'}])
+        self.assertEqual(errors['slots'], {0: {'material': "value 'not-a-uuid' cannot be converted to a UUID"}})
+
+    def test_material_that_is_not_a_string(self):
+        for material in (5, ['x'], {'x': 1}):
+            errors = self._assert_same_errors([{'address': 'A:1', 'material': material}])
+            self.assertEqual(errors['slots'], {0: {'material': "value %r cannot be converted to a UUID" % material}})
+
+    def test_update_takes_geometry_from_original(self):
+        original = {'num_of_rows': 2, 'num_of_cols': 3, 'row_is_alpha': True, 'col_is_alpha': False}
+        for fast in (True, False):
+            self.app.config['FAST_SLOT_VALIDATION'] = fast
+            with self.app.app_context():
+                validator = CustomValidator(container_schema)
+                validator.validate_update({'slots': [{'address': 'A:1'}, {'address': 'C:1'}]}, None, original)
+                self.assertEqual(validator.errors, {'slots': {1: {'address': "Row out of range: 'C:1'"}}})
+
+    def test_malformed_slots(self):
+        self._assert_same_errors([{'address': 'A:1', 'colour': 'red'}])
+        self._assert_same_errors([{'address': 5}])
+
+
+class CollectRelationValuesTests(unittest.TestCase):
+
+    def test_collects_slot_materials(self):
+        material = '3b1f6a2e-8d4c-4f3e-9a5b-1c2d3e4f5a6b'
+        document = {'num_of_rows': 1, 'num_of_cols': 2,
+                    'slots': [{'address': '1', 'material': material}, {'address': '2'},
+                              {'address': '3', 'material': 'not-a-uuid'}]}
+        values = {}
+        collect_relation_values(container_schema, document, values)
+        self.assertEqual(values, {('materials', '_id'): {material}})
+
+    def test_collects_parents_and_ancestors_together(self):
+        ids = ['3b1f6a2e-8d4c-4f3e-9a5b-1c2d3e4f5a6%s' % i for i in xrange(3)]
+        values = {}
+        collect_relation_values(material_schema, {'parents': ids[:2]}, values)
+        collect_relation_values(material_schema, {'parents': ids[1:2], 'ancestors': ids[1:]}, values)
+        self.assertEqual(values, {('materials', '_id'): set(ids)})
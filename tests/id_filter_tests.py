@@ -0,0 +1,105 @@
+import unittest
+import uuid
+from datetime import datetime, timedelta
+
+from id_filter import BloomFilter, IdFilter
+
+
+class FakeMaterials(object):
+    """Holds documents with an _id and _created, and answers the queries IdFilter makes."""
+
+    def __init__(self):
+        self.docs = []
+
+    def insert(self, _id, created=None):
+        self.docs.append({'_id': _id, '_created': created or datetime.utcnow()})
+
+    def count(self):
+        return len(self.docs)
+
+    def find(self, filter, projection=None):
+        since = filter.get('_created', {}).get('$gte')
+        return [doc for doc in self.docs if since is None or doc['_created'] >= since]
+
+
+class BloomFilterTests(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        ids = [str(uuid.uuid4()) for _ in xrange(1000)]
+        for _id in ids:
+            bloom.add(_id)
+        self.assertTrue(all(_id in bloom for _id in ids))
+        # Ids which were already false positives are not counted
+        self.assertGreater(bloom.count, 950)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for _ in xrange(1000):
+            bloom.add(str(uuid.uuid4()))
+        false_positives = sum(str(uuid.uuid4()) in bloom for _ in xrange(10000))
+        self.assertLess(false_positives, 300)
+        self.assertAlmostEqual(bloom.false_positive_rate(), 0.01, delta=0.005)
+
+    def test_adding_again_uses_no_capacity(self):
+        bloom = BloomFilter(10)
+        bloom.add(u'abc')
+        bloom.add('abc')
+        self.assertEqual(bloom.count, 1)
+
+
+class IdFilterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.materials = FakeMaterials()
+        self.ids = [str(uuid.uuid4()) for _ in xrange(3)]
+        for _id in self.ids:
+            self.materials.insert(_id, datetime.utcnow() - timedelta(days=1))
+        self.filter = IdFilter(100)
+        self.filter.warm(self.materials)
+
+    def test_absent(self):
+        unknown = str(uuid.uuid4())
+        self.assertEqual(self.filter.absent(self.materials, self.ids + [unknown]), {unknown})
+
+    def test_ids_inserted_by_other_workers_are_synced(self):
+        _id = str(uuid.uuid4())
+        self.materials.insert(_id)
+        self.assertEqual(self.filter.absent(self.materials, [_id]), set())
+
+    def test_sync_interval(self):
+        id_filter = IdFilter(100, sync_interval=3600)
+        id_filter.warm(self.materials)
+        self.assertEqual(len(id_filter.absent(self.materials, [str(uuid.uuid4())])), 1)
+        _id = str(uuid.uuid4())
+        self.materials.insert(_id)
+        # Synced within the interval, so the new id is not seen yet
+        self.assertEqual(id_filter.absent(self.materials, [_id]), {_id})
+        self.assertEqual(id_filter.stats()['syncs'], 1)
+
+    def test_rebuilds_in_background_when_full(self):
+        id_filter = IdFilter(2)
+        id_filter.warm(self.materials)
+        for _ in xrange(10):
+            _id = str(uuid.uuid4())
+            self.materials.insert(_id)
+            id_filter.add(_id)
+        old_bloom = id_filter.bloom
+        id_filter.absent(self.materials, [str(uuid.uuid4())])
+        id_filter.rebuild_thread.join()
+        self.assertIsNot(id_filter.bloom, old_bloom)
+        self.assertEqual(id_filter.capacity, 26)
+        self.assertEqual(id_filter.stats()['rebuilds'], 1)
+        self.assertTrue(all(doc['_id'] in id_filter.bloom for doc in self.materials.docs))
+
+    def test_stats(self):
+        self.filter.absent(self.materials, self.ids + [str(uuid.uuid4())])
+        self.filter.record_false_positives(1)
+        stats = self.filter.stats()
+        self.assertEqual((stats['count'], stats['lookups'], stats['negatives']), (3, 4, 1))
+        self.assertEqual(stats['observed_false_positive_rate'], 1/3.0)
+        self.assertGreater(stats['memory_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+
+from importer import batched, ndjson_rows
+
+
+class ImporterTests(unittest.TestCase):
+
+    def test_batched(self):
+        self.assertEqual(list(batched(iter(xrange(5)), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+    def test_ndjson_rows(self):
+        rows = list(ndjson_rows(['{"a": 1}\n', '\n', '{"a": \n', '[1, 2]\n', '{"b": "c"}']))
+        self.assertEqual(rows[0], ({'a': 1}, None))
+        self.assertEqual(rows[1][0], None)
+        self.assertIn('json', rows[1][1])
+        self.assertEqual(rows[2], (None, {'json': 'Each line must be a JSON object'}))
+        self.assertEqual(rows[3], ({'b': 'c'}, None))
+        self.assertEqual(len(rows), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
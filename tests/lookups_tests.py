@@ -0,0 +1,64 @@
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from lookups import chunked, find_by_ids, find_in_order, missing_ids, ownership_issues, unique
+
+
+class FakeCollection(object):
+    """Answers $in queries on _id from a dict of documents, recording each query."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, filter, projection=None):
+        ids = filter['_id']['$in']
+        self.queries.append(ids)
+        return [self.docs[_id] for _id in ids if _id in self.docs]
+
+
+class LookupsTests(unittest.TestCase):
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_find_by_ids_in_chunks(self):
+        collection = FakeCollection({i: {'_id': i} for i in xrange(0, 10, 2)})
+        docs = list(find_by_ids(collection, range(10), chunk_size=4))
+        self.assertEqual([doc['_id'] for doc in docs], [0, 2, 4, 6, 8])
+        self.assertEqual([len(ids) for ids in collection.queries], [4, 4, 2])
+
+    def test_unique(self):
+        self.assertEqual(unique(['b', 'a', 'b', 'c', 'a']), ['b', 'a', 'c'])
+
+    def test_missing_ids(self):
+        collection = FakeCollection({i: {'_id': i} for i in xrange(0, 10, 3)})
+        ids = [9, 1, 2, 3, 1, 4, 5, 6, 7]
+        self.assertEqual(list(missing_ids(collection, ids, chunk_size=3)), [[1, 2], [4, 5], [7]])
+
+        pool = ThreadPool(2)
+        try:
+            self.assertEqual(list(missing_ids(collection, ids, chunk_size=2, pool=pool)),
+                             [[1], [2], [4, 5], [7]])
+        finally:
+            pool.close()
+
+    def test_find_in_order(self):
+        collection = FakeCollection({i: {'_id': i} for i in xrange(0, 10, 3)})
+        pool = ThreadPool(2)
+        try:
+            chunks = list(find_in_order(collection, [9, 1, 0, 9, 3], chunk_size=2, pool=pool))
+        finally:
+            pool.close()
+        self.assertEqual(chunks, [[(9, {'_id': 9}), (1, None)], [(0, {'_id': 0}), (3, {'_id': 3})]])
+
+    def test_ownership_issues(self):
+        owners = {'a': 'me', 'b': 'you', 'c': 'me', 'd': None}
+        self.assertEqual(ownership_issues(owners, ['x', 'a', 'b', 'x', 'd', 'c', 'b', 'y'], 'me'),
+                         (['x', 'y'], ['b', 'd']))
+        self.assertEqual(ownership_issues(owners, ['a', 'c'], 'me'), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from manifest import coerce_cell, header_patterns, manifest_rows, map_headers
+from schema import material_schema
+
+
+class ManifestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.patterns = header_patterns(material_schema)
+
+    def test_map_headers(self):
+        headers = ['Supplier Name', 'SEX', 'Tumor?', 'Donor', 'date_of_receipt', 'Notes', '_id']
+        self.assertEqual(map_headers(headers, material_schema, self.patterns),
+                         ['supplier_name', 'gender', 'is_tumour', 'donor_id', 'date_of_receipt', None, None])
+
+    def test_map_headers_refuses_two_columns_for_one_field(self):
+        self.assertRaises(ValueError, map_headers, ['Gender', 'Sex'], material_schema, self.patterns)
+
+    def test_coerce_cell(self):
+        self.assertIs(coerce_cell({'type': 'boolean'}, 'Yes'), True)
+        self.assertIs(coerce_cell({'type': 'boolean'}, 'false'), False)
+        self.assertEqual(coerce_cell({'type': 'boolean'}, 'maybe'), 'maybe')
+        self.assertEqual(coerce_cell({'type': 'float'}, '1.5'), 1.5)
+        self.assertEqual(coerce_cell({'type': 'float'}, 'lots'), 'lots')
+        self.assertEqual(coerce_cell({'type': 'string'}, '12'), '12')
+
+    def test_manifest_rows(self):
+        lines = ['\xef\xbb\xbfDonor ID\tGender\tAvailable\tConcentration\tComments\n',
+                 'd1\tfemale\tyes\t2.5\tfine\n',
+                 '\t\t\t\t\n',
+                 'd2\tmale\n']
+        headers, fields, rows = manifest_rows(lines, material_schema, self.patterns)
+        self.assertEqual(headers, ['Donor ID', 'Gender', 'Available', 'Concentration', 'Comments'])
+        self.assertEqual(fields, ['donor_id', 'gender', 'available', 'concentration', None])
+        self.assertEqual(list(rows), [
+            ({'donor_id': 'd1', 'gender': 'female', 'available': True, 'concentration': 2.5}, None),
+            ({'donor_id': 'd2', 'gender': 'male'}, None)])
+
+    def test_csv_with_quoted_cells(self):
+        lines = ['phenotype,donor id\n', '"eye, colour",d1\n']
+        headers, fields, rows = manifest_rows(lines, material_schema, self.patterns)
+        self.assertEqual(list(rows), [({'phenotype': 'eye, colour', 'donor_id': 'd1'}, None)])
+
+    def test_rows_that_are_not_utf8(self):
+        lines = ['phenotype,donor id\n', 'caf\xe9,d1\n', 'caf\xc3\xa9,d2\n']
+        headers, fields, rows = manifest_rows(lines, material_schema, self.patterns)
+        rows = list(rows)
+        self.assertEqual(rows[0][0], None)
+        self.assertIn('encoding', rows[0][1])
+        self.assertEqual(rows[1], ({'phenotype': u'caf\xe9', 'donor_id': 'd2'}, None))
+
+    def test_header_that_is_not_utf8(self):
+        self.assertRaises(ValueError, manifest_rows, ['caf\xe9,donor id\n'], material_schema, self.patterns)
+
+    def test_rows_that_are_not_csv(self):
+        lines = ['phenotype,donor id\n', 'eye\x00,d1\n', 'hair,d2\n']
+        headers, fields, rows = manifest_rows(lines, material_schema, self.patterns)
+        rows = list(rows)
+        self.assertEqual(rows[0][0], None)
+        self.assertIn('csv', rows[0][1])
+        self.assertEqual(rows[1], ({'phenotype': 'hair', 'donor_id': 'd2'}, None))
+
+    def test_utf16_manifest(self):
+        lines = u'phenotype\tdonor id\n'.encode('utf-16').splitlines(True)
+        self.assertRaises(ValueError, manifest_rows, lines, material_schema, self.patterns)
+
+    def test_empty_manifest(self):
+        self.assertRaises(ValueError, manifest_rows, [], material_schema, self.patterns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
 import utils
+import json
 import jwt
 import uuid
 
+from flask import current_app
+from id_filter import IdFilter
+from result_cache import ResultCache
 from tests import ServiceTestBase, valid_material_params
 
 
@@ -38,6 +42,34 @@ class TestMaterials(ServiceTestBase):
         r, status = self.post(self.domain['materials']['url'], params)
         self.assert422(status)
 
+    def test_missing_parents_are_each_reported(self):
+        r1, status1 = self.post(self.domain['materials']['url'], valid_material_params())
+        self.assert201(status1)
+
+        missing = [str(uuid.uuid4()), str(uuid.uuid4())]
+        params = valid_material_params()
+        params['parents'] = [r1['_id']] + missing
+        r, status = self.post(self.domain['materials']['url'], params)
+        self.assert422(status)
+        self.assertEqual(sorted(r['_issues']['parents']), ['1', '2'])
+        for i, material_id in enumerate(missing, 1):
+            self.assertIn(material_id, r['_issues']['parents'][str(i)])
+
+    def test_bulk_materials_with_parents_checked_together(self):
+        r1, status1 = self.post(self.domain['materials']['url'], valid_material_params())
+        self.assert201(status1)
+
+        good = utils.merge_dict(valid_material_params(), {'parents': [r1['_id']], 'ancestors': [r1['_id']]})
+        bad = utils.merge_dict(valid_material_params(), {'parents': [str(uuid.uuid4())]})
+        r, status = self.post(self.domain['materials']['url'], [good, good])
+        self.assert201(status)
+
+        r, status = self.post(self.domain['materials']['url'], [good, bad])
+        self.assert422(status)
+        self.assertEqual(r['_items'][0]['_status'], 'OK')
+        self.assertEqual(r['_items'][1]['_status'], 'ERR')
+        self.assertIn('parents', r['_items'][1]['_issues'])
+
     def test_get_empty_resource(self):
         response, status = self.get('materials')
         self.assert200(status)
@@ -216,6 +248,56 @@ class TestMaterials(ServiceTestBase):
         r, status = self.post('/materials', data=data, headers=[('X-Authorisation', 'jibberish.jwt.rubbish')])
         self.assert401(status)
 
+    def test_validate_materials(self):
+        materials = [self.post('/materials', data=valid_material_params())[0]['_id'] for _ in xrange(3)]
+        unknown = [str(uuid.uuid4()), str(uuid.uuid4())]
+        self.app.config['LOOKUP_CHUNK_SIZE'] = 2
+        data = json.dumps({'materials': [unknown[0]] + materials + [unknown[1], unknown[0]]})
+
+        r = self.test_client.post('/materials/validate', data=data, content_type='application/json')
+        self.assertEqual(r.data, "not ok - some materials not found")
+        r = self.test_client.post('/materials/validate', data=json.dumps({'materials': materials}),
+                                  content_type='application/json')
+        self.assertEqual(r.data, "ok")
+
+        # Accepting JSON alone doesn't change the response
+        r = self.test_client.post('/materials/validate', data=data, content_type='application/json',
+                                  headers=[('Accept', 'application/json')])
+        self.assertEqual(r.data, "not ok - some materials not found")
+
+        report_data = json.dumps({'materials': [unknown[0]] + materials + [unknown[1]], 'report_missing': True})
+        r = self.test_client.post('/materials/validate', data=report_data, content_type='application/json')
+        self.assert200(r.status_code)
+        self.assertEqual(json.loads(r.data), {'valid': False, 'missing': unknown})
+
+        r = self.test_client.post('/materials/validate', data=data, content_type='application/json',
+                                  headers=[('Accept', 'application/x-ndjson')])
+        self.assertEqual(r.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in r.data.splitlines()], unknown)
+
+    def test_validate_materials_with_id_filter(self):
+        self.app.material_id_filter = IdFilter(1000)
+        with self.app.app_context():
+            self.app.material_id_filter.warm(current_app.data.driver.db.materials)
+        materials = [self.post('/materials', data=valid_material_params())[0]['_id'] for _ in xrange(2)]
+        unknown = str(uuid.uuid4())
+
+        r, status = self.post('/materials/validate', data={'materials': materials + [unknown], 'report_missing': True})
+        self.assertEqual(r, {'valid': False, 'missing': [unknown]})
+
+        r, status = self.post('/materials/verify_ownership', data={'owner_id': 'abc',
+                                                                   'materials': materials + [unknown]})
+        self.assert422(status)
+
+        r, status = self.get('materials/id_filter')
+        self.assert200(status)
+        self.assertEqual(r['count'], 2)
+        self.assertEqual(r['negatives'], 2)
+
+    def test_id_filter_stats_when_disabled(self):
+        r, status = self.get('materials/id_filter')
+        self.assert404(status)
+
     def test_verify_ownership_422_missing_owner_id(self):
         materials_data = utils.merge_dict(valid_material_params(), {'owner_id': 'abc'})
         r, _ = self.post('/materials', data=materials_data)
@@ -237,6 +319,12 @@ class TestMaterials(ServiceTestBase):
         r, status = self.post('/materials/verify_ownership', data=data)
         self.assert200(status)
 
+    def test_verify_ownership_422_when_ids_are_not_strings(self):
+        for data in ({'owner_id': 'abc', 'materials': [{'_id': 'x'}]}, {'owner_id': 'abc', 'materials': [['x']]},
+                     {'owner_id': ['abc'], 'materials': ['x']}):
+            r, status = self.post('/materials/verify_ownership', data=data)
+            self.assert422(status)
+
     def test_verify_ownership_materials_belong_to_owner_id(self):
         materials_data = utils.merge_dict(valid_material_params(), {'owner_id': 'abc'})
 
@@ -267,6 +355,220 @@ class TestMaterials(ServiceTestBase):
         self.assert403(status)
         self.assertEqual(len(r['_issues']), 2)
 
+    def test_verify_ownership_reports_foreign_materials_in_order(self):
+        abc_materials_data = utils.merge_dict(valid_material_params(), {'owner_id': 'abc'})
+        xyz_materials_data = utils.merge_dict(valid_material_params(), {'owner_id': 'xyz'})
+
+        materials = [self.post('/materials', data=data)[0]['_id']
+                     for data in (abc_materials_data, xyz_materials_data, abc_materials_data)]
+
+        data = {'owner_id': 'xyz', 'materials': materials + materials}
+        self.app.config['LOOKUP_CHUNK_SIZE'] = 2
+        r, status = self.post('/materials/verify_ownership', data=data)
+
+        self.assert403(status)
+        self.assertEqual(r['_issues'], [materials[0], materials[2]])
+
+        data = {'owner_id': 'xyz', 'materials': materials + [str(uuid.uuid4())]}
+        r, status = self.post('/materials/verify_ownership', data=data)
+        self.assert422(status)
+
+    def test_transfer_ownership(self):
+        abc_materials_data = utils.merge_dict(valid_material_params(), {'owner_id': 'abc'})
+        materials = [self.post('/materials', data=abc_materials_data)[0]['_id'] for _ in xrange(3)]
+
+        data = {'materials': materials[:2], 'from_owner': 'abc', 'to_owner': 'xyz'}
+        r, status = self.post('/materials/transfer_ownership', data=data)
+        self.assert200(status)
+        self.assertEqual((r['matched'], r['modified']), (2, 2))
+
+        r, status = self.get('materials', '?where={"owner_id": "xyz"}')
+        self.assertEqual(sorted(item['_id'] for item in r['_items']), sorted(materials[:2]))
+
+        # Materials which no longer belong to from_owner are refused, and none are changed
+        data = {'materials': materials, 'from_owner': 'abc', 'to_owner': 'def'}
+        r, status = self.post('/materials/transfer_ownership', data=data)
+        self.assert403(status)
+        self.assertEqual(sorted(r['_issues']), sorted(materials[:2]))
+        r, status = self.get('materials', '?where={"owner_id": "def"}')
+        self.assertEqual(r['_items'], [])
+
+    def test_transfer_ownership_401_when_invalid_jwt(self):
+        r, _ = self.post('/materials', data=utils.merge_dict(valid_material_params(), {'owner_id': 'abc'}))
+        data = {'materials': [r['_id']], 'from_owner': 'abc', 'to_owner': 'xyz'}
+        r, status = self.post('/materials/transfer_ownership', data=data,
+                              headers=[('X-Authorisation', 'jibberish.jwt.rubbish')])
+        self.assert401(status)
+        r, status = self.get('materials', '?where={"owner_id": "xyz"}')
+        self.assertEqual(r['_items'], [])
+
+    def test_transfer_ownership_422(self):
+        r, _ = self.post('/materials', data=valid_material_params())
+        r, status = self.post('/materials/transfer_ownership', data={'materials': [r['_id']], 'from_owner': 'abc'})
+        self.assert422(status)
+        r, status = self.post('/materials/transfer_ownership', data={'materials': [str(uuid.uuid4())],
+                                                                     'from_owner': 'abc', 'to_owner': 'xyz'})
+        self.assert422(status)
+        r, status = self.post('/materials/transfer_ownership', data={'materials': [{'_id': 'x'}],
+                                                                     'from_owner': 'abc', 'to_owner': 'xyz'})
+        self.assert422(status)
+        r, status = self.post('/materials/transfer_ownership', data={'materials': ['x'],
+                                                                     'from_owner': {'$ne': 'abc'}, 'to_owner': 'xyz'})
+        self.assert422(status)
+
+    def test_import_materials(self):
+        self.app.config['IMPORT_BATCH_SIZE'] = 2
+        lines = [
+            json.dumps(valid_material_params()),
+            json.dumps(utils.merge_dict(valid_material_params(), {'gender': 'robot'})),
+            'not json',
+            json.dumps(utils.merge_dict(valid_material_params(), {'owner_id': 'abc'})),
+            json.dumps(utils.merge_dict(valid_material_params(), {'parents': [str(uuid.uuid4())]})),
+        ]
+        r = self.test_client.post('/materials/import', data='\n'.join(lines) + '\n',
+                                  content_type='application/x-ndjson')
+        self.assert200(r.status_code)
+        body = json.loads(r.data)
+        self.assertEqual((body['_status'], body['inserted'], body['failed']), ('ERR', 2, 3))
+        self.assertEqual([item['_status'] for item in body['_items']], ['OK', 'ERR', 'ERR', 'OK', 'ERR'])
+        self.assertIn('gender', body['_items'][1]['_issues'])
+        self.assertIn('json', body['_items'][2]['_issues'])
+        self.assertIn('parents', body['_items'][4]['_issues'])
+
+        r, status = self.get('materials', '', body['_items'][3]['_id'])
+        self.assert200(status)
+        self.assertEqual(r['owner_id'], 'abc')
+        r, status = self.get('materials', '', body['_items'][0]['_id'])
+        self.assertEqual(r['owner_id'], 'guest')
+        self.assertIn('_created', r)
+
+    def test_import_materials_all_valid_or_all_invalid(self):
+        r = self.test_client.post('/materials/import', data=json.dumps(valid_material_params()),
+                                  content_type='application/x-ndjson')
+        self.assert201(r.status_code)
+        r = self.test_client.post('/materials/import', data='{}', content_type='application/x-ndjson')
+        self.assert422(r.status_code)
+
+    def test_import_material_manifest(self):
+        manifest = '\n'.join([
+            'Supplier Name,Donor,Sex,Taxon ID,Scientific Name,Tissue Type,Tumour?,Notes',
+            'supplier 1,donor 1,female,9606,Homo sapiens,Blood,normal,first',
+            'supplier 2,donor 2,robot,9606,Homo sapiens,Blood,normal,second',
+        ]) + '\n'
+        r = self.test_client.post('/materials/manifest', data=manifest, content_type='text/csv')
+        self.assert200(r.status_code)
+        body = json.loads(r.data)
+        self.assertEqual((body['inserted'], body['failed']), (1, 1))
+        self.assertEqual(body['columns'][1], {'header': 'Donor', 'field': 'donor_id'})
+        self.assertEqual(body['columns'][7], {'header': 'Notes', 'field': None})
+        self.assertIn('gender', body['_items'][1]['_issues'])
+
+        r, status = self.get('materials', '', body['_items'][0]['_id'])
+        self.assertEqual((r['donor_id'], r['gender'], r['is_tumour']), ('donor 1', 'female', 'normal'))
+
+    def test_import_material_manifest_that_is_not_utf8(self):
+        manifest = '\n'.join([
+            'Supplier Name,Donor,Sex,Taxon ID,Scientific Name,Tissue Type,Tumour?,Phenotype',
+            'supplier 1,donor 1,female,9606,Homo sapiens,Blood,normal,caf\xe9',
+            'supplier 2,donor 2,female,9606,Homo sapiens,Blood,normal,tea',
+        ]) + '\n'
+        r = self.test_client.post('/materials/manifest', data=manifest, content_type='text/csv')
+        self.assert200(r.status_code)
+        body = json.loads(r.data)
+        self.assertEqual((body['inserted'], body['failed']), (1, 1))
+        self.assertIn('encoding', body['_items'][0]['_issues'])
+
+        r = self.test_client.post('/materials/manifest', data='Caf\xe9,Donor\n', content_type='text/csv')
+        self.assert422(r.status_code)
+
+    def test_import_material_manifest_with_ambiguous_headers(self):
+        r = self.test_client.post('/materials/manifest', data='Gender\tSex\nfemale\tfemale\n',
+                                  content_type='text/tab-separated-values')
+        self.assert422(r.status_code)
+
+    def test_bulk_update_materials(self):
+        for owner_id in ('abc', 'abc', 'xyz'):
+            self.post('/materials', data=utils.merge_dict(valid_material_params(), {'owner_id': owner_id,
+                                                                                    'available': True}))
+        data = {'where': {'owner_id': 'abc'}, '$set': {'available': False}}
+
+        r, status = self.patch('/materials/bulk', data=dict(data, dry_run=True))
+        self.assert200(status)
+        self.assertEqual(r['matched'], 2)
+        r, status = self.get('materials', '?where={"available": false}')
+        self.assertEqual(r['_items'], [])
+
+        r, status = self.patch('/materials/bulk', data=data)
+        self.assert200(status)
+        self.assertEqual((r['matched'], r['modified']), (2, 2))
+        r, status = self.get('materials', '?where={"available": false}')
+        self.assertEqual(sorted(item['owner_id'] for item in r['_items']), ['abc', 'abc'])
+
+    def test_bulk_update_materials_422(self):
+        r, status = self.patch('/materials/bulk', data={'where': {'owner_id': 'abc'}, '$set': {'gender': 'robot'}})
+        self.assert422(status)
+        self.assertIn('gender', r['_issues'])
+        r, status = self.patch('/materials/bulk', data={'where': {'owner_id': 'abc'},
+                                                        '$set': {'_id': 'x', 'colour': 1}})
+        self.assert422(status)
+        self.assertEqual(sorted(r['_issues']), ['_id', 'colour'])
+        r, status = self.patch('/materials/bulk', data={'where': {}, '$set': {'available': False}})
+        self.assert422(status)
+
+    def test_batch_get_materials(self):
+        materials = [self.post('/materials', data=valid_material_params())[0]['_id'] for _ in xrange(3)]
+        unknown = str(uuid.uuid4())
+        self.app.config['LOOKUP_CHUNK_SIZE'] = 2
+        ids = [materials[2], unknown, materials[0], materials[2], materials[1]]
+
+        r, status = self.post('/materials/batch', data={'ids': ids, 'projection': {'_id': 0, 'gender': 1}})
+        self.assert200(status)
+        self.assertEqual(r['_items'], [{'gender': 'female'}] * 3)
+        self.assertEqual(r['_missing'], [unknown])
+
+        r, status = self.post('/materials/batch', data={'ids': ids})
+        self.assertEqual([item['_id'] for item in r['_items']], [materials[2], materials[0], materials[1]])
+
+        r = self.test_client.post('/materials/batch', data=json.dumps({'ids': ids}),
+                                  content_type='application/json', headers=[('Accept', 'application/x-ndjson')])
+        lines = [json.loads(line) for line in r.data.splitlines()]
+        self.assertEqual([line.get('_id') or line.get('_missing') for line in lines],
+                         [materials[2], unknown, materials[0], materials[1]])
+
+        r, status = self.post('/materials/batch', data={'materials': ids})
+        self.assert422(status)
+
+    def test_batch_get_and_validate_422_when_ids_are_not_strings(self):
+        for ids in ([{'_id': 'x'}], [['x']], ['x', 1], 'x'):
+            r, status = self.post('/materials/batch', data={'ids': ids})
+            self.assert422(status)
+            r, status = self.post('/materials/validate', data={'materials': ids})
+            self.assert422(status)
+
+    def test_material_locations(self):
+        r1, _ = self.post('/materials', data=valid_material_params())
+        r2, _ = self.post('/materials', data=valid_material_params())
+        r3, _ = self.post('/materials', data=valid_material_params())
+        container = {'num_of_rows': 2, 'num_of_cols': 2, 'row_is_alpha': True, 'col_is_alpha': False,
+                     'barcode': 'XYZ-123',
+                     'slots': [{'address': 'A:2', 'material': r1['_id']}, {'address': 'B:1', 'material': r2['_id']}]}
+        c, status = self.post('/containers', data=container)
+        self.assert201(status)
+
+        r, status = self.post('/materials/locations', data={'materials': [r1['_id'], r2['_id'], r3['_id']]})
+        self.assert200(status)
+        self.assertEqual(r, {
+            r1['_id']: {'container_id': c['_id'], 'barcode': 'XYZ-123', 'address': 'A:2'},
+            r2['_id']: {'container_id': c['_id'], 'barcode': 'XYZ-123', 'address': 'B:1'},
+            r3['_id']: None,
+        })
+
+    def test_material_locations_422_missing_materials(self):
+        r, status = self.post('/materials/locations', data={})
+        self.assert422(status)
+        r, status = self.post('/materials/locations', data={'materials': [{'_id': 'x'}]})
+        self.assert422(status)
+
     def test_submitter_id_is_set(self):
         submitter_id = 'abc@test.com'
         materials_data = utils.merge_dict(valid_material_params(), {'submitter_id': submitter_id})
@@ -293,6 +595,237 @@ class TestMaterials(ServiceTestBase):
         self.assert200(status)
         self.assertEqual(len(r['_items']), 0)
 
+    def test_bulk_search_materials_by_date(self):
+        for date in ['Thu, 01 Mar 2018 00:00:00 GMT', 'Sun, 01 Apr 2018 00:00:00 GMT']:
+            self.post('/materials', data=utils.merge_dict(valid_material_params(), {'date_of_receipt': date}))
+
+        query = {'where': {'date_of_receipt': {'$gte': 'Thu, 15 Mar 2018 00:00:00 GMT'}}}
+        for _ in range(2):
+            r, status = self.post('/materials/search', data=query)
+            self.assert200(status)
+            self.assertEqual([item['date_of_receipt'] for item in r['_items']], ['Sun, 01 Apr 2018 00:00:00 GMT'])
+
+    def _search_all_pages(self, query):
+        pages = []
+        r, status = self.post('/materials/search', data=query)
+        self.assert200(status)
+        pages.append(r['_items'])
+        while 'next' in r['_links']:
+            r, status = self.post('/materials/search', data=dict(query, cursor=r['_links']['next']['cursor']))
+            self.assert200(status)
+            pages.append(r['_items'])
+        return pages
+
+    def test_bulk_search_materials_with_cursor(self):
+        donors = ['d', 'b', 'a', 'b', 'c']
+        for donor_id in donors:
+            self.post('/materials', data=utils.merge_dict(valid_material_params(), {'donor_id': donor_id}))
+
+        query = {'where': {}, 'max_results': 2, 'sort_by': 'donor_id', 'sort_order': 1}
+        pages = self._search_all_pages(query)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([item['donor_id'] for page in pages for item in page], sorted(donors))
+        self.assertEqual(len({item['_id'] for page in pages for item in page}), len(donors))
+
+        query['sort_order'] = -1
+        query['projection'] = {'gender': 1}
+        pages = self._search_all_pages(query)
+        self.assertEqual(len({item['_id'] for page in pages for item in page}), len(donors))
+        self.assertFalse(any('donor_id' in item for page in pages for item in page))
+
+    def test_bulk_search_materials_with_cursor_on_embedded_field(self):
+        ranks = [3, 1, 2]
+        for rank in ranks:
+            self.post('/materials', data=utils.merge_dict(valid_material_params(), {'meta': {'rank': rank}}))
+
+        query = {'where': {}, 'max_results': 2, 'sort_by': 'meta.rank', 'sort_order': 1,
+                 'projection': {'gender': 1}}
+        pages = self._search_all_pages(query)
+        self.assertEqual([len(page) for page in pages], [2, 1])
+        self.assertEqual(len({item['_id'] for page in pages for item in page}), len(ranks))
+        self.assertFalse(any('meta' in item for page in pages for item in page))
+
+    def test_bulk_search_materials_pages_still_work(self):
+        for _ in range(3):
+            self.post('/materials', data=valid_material_params())
+
+        r, status = self.post('/materials/search', data={'where': {}, 'max_results': 2, 'page': 2})
+        self.assert200(status)
+        self.assertEqual(len(r['_items']), 1)
+        self.assertEqual(r['_links']['prev'], {'page': 1})
+        self.assertNotIn('next', r['_links'])
+
+        r, status = self.post('/materials/search', data={'where': {}, 'max_results': 2, 'page': 1})
+        self.assertEqual(r['_links']['next']['page'], 2)
+
+    def test_bulk_search_materials_total_modes(self):
+        for _ in range(3):
+            self.post('/materials', data=valid_material_params())
+        query = {'where': {'gender': 'female'}, 'max_results': 2}
+
+        r, status = self.post('/materials/search', data=dict(query, total='exact'))
+        self.assert200(status)
+        self.assertEqual(r['_meta']['total'], 3)
+        self.assertEqual(r['_links']['last'], {'page': 2})
+
+        r, status = self.post('/materials/search', data=dict(query, total='estimate'))
+        self.assert200(status)
+        self.assertEqual(r['_meta']['total'], 3)
+        self.assertFalse(r['_meta']['total_estimated'])
+
+        self.app.config['SEARCH_TOTAL_ESTIMATE_CAP'] = 2
+        r, status = self.post('/materials/search', data=dict(query, total='estimate'))
+        self.assertEqual(r['_meta']['total'], 2)
+        self.assertTrue(r['_meta']['total_estimated'])
+        self.assertEqual(r['_links']['next']['page'], 2)
+        self.assertNotIn('last', r['_links'])
+
+        r, status = self.post('/materials/search', data=dict(query, total='none'))
+        self.assert200(status)
+        self.assertNotIn('total', r['_meta'])
+        self.assertEqual(len(r['_items']), 2)
+        self.assertEqual(r['_links']['next']['page'], 2)
+
+        r, status = self.post('/materials/search', data=dict(query, total='none', page=2))
+        self.assertEqual(len(r['_items']), 1)
+        self.assertNotIn('next', r['_links'])
+
+        r, status = self.post('/materials/search', data=dict(query, total='sometimes'))
+        self.assert400(status)
+
+    def test_bulk_search_materials_default_total_mode(self):
+        self.post('/materials', data=valid_material_params())
+        self.domain['materials']['search_total'] = 'none'
+        try:
+            r, status = self.post('/materials/search', data={'where': {}})
+        finally:
+            self.domain['materials']['search_total'] = 'exact'
+        self.assert200(status)
+        self.assertNotIn('total', r['_meta'])
+
+    def test_bulk_search_materials_with_invalid_cursor(self):
+        r, status = self.post('/materials/search', data={'where': {}, 'max_results': 2, 'cursor': 'nonsense'})
+        self.assert400(status)
+
+    def test_bulk_search_materials_streams_ndjson(self):
+        for donor_id in ['a', 'b', 'c']:
+            self.post('/materials', data=utils.merge_dict(valid_material_params(), {'donor_id': donor_id}))
+
+        r = self.test_client.post('/materials/search',
+                                  data=json.dumps({'where': {}, 'batch_size': 2, 'sort_by': 'donor_id',
+                                                   'sort_order': 1}),
+                                  headers=[('Content-Type', 'application/json'),
+                                           ('Accept', 'application/x-ndjson')])
+        self.assert200(r.status_code)
+        self.assertEqual(r.mimetype, 'application/x-ndjson')
+        items = [json.loads(line) for line in r.get_data().splitlines()]
+        self.assertEqual([item['donor_id'] for item in items], ['a', 'b', 'c'])
+        self.assertTrue(all('_created' in item for item in items))
+
+    def test_search_index_advice(self):
+        query = {'where': {'owner_id': 'abc', 'available': True}, 'sort_by': 'donor_id', 'sort_order': 1,
+                 'max_results': 10}
+        self.post('/materials/search', data=query)
+
+        r, status = self.get('materials/search/index_advice')
+        self.assert200(status)
+        self.assertEqual(len(r['_items']), 1)
+        advice = r['_items'][0]
+        self.assertEqual(advice['filter'], {'owner_id': ['$eq'], 'available': ['$eq']})
+        self.assertEqual(advice['index'], [['available', 1], ['owner_id', 1], ['donor_id', 1], ['_id', 1]])
+        self.assertFalse(advice['index_exists'])
+
+        r, status = self.post('/materials/search/index_advice', data={'create': True})
+        self.assert403(status)
+
+        self.app.config['INDEX_ADVICE_CREATE'] = True
+        r, status = self.post('/materials/search/index_advice', data={'create': True},
+                              headers=[('X-Authorisation', 'jibberish.jwt.rubbish')])
+        self.assert401(status)
+        r, status = self.get('materials/search/index_advice')
+        self.assertFalse(r['_items'][0]['index_exists'])
+
+    def test_search_results_cache(self):
+        self.app.search_cache = ResultCache(16, 30)
+        self.post('/materials', data=valid_material_params())
+        query = {'where': {'gender': 'female'}}
+
+        r, status = self.post('/materials/search', data=query)
+        self.assertEqual(r['_meta']['total'], 1)
+        r, status = self.post('/materials/search', data=query)
+        self.assertEqual(r['_meta']['total'], 1)
+
+        r, status = self.get('search/cache')
+        self.assert200(status)
+        self.assertEqual((r['hits'], r['misses'], r['entries']), (1, 1, 1))
+
+        # Writing to materials invalidates the cached response
+        self.post('/materials', data=valid_material_params())
+        r, status = self.post('/materials/search', data=query)
+        self.assertEqual(r['_meta']['total'], 2)
+        self.assertEqual(self.app.search_cache.stats()['misses'], 2)
+
+    def test_search_results_cache_disabled(self):
+        r, status = self.get('search/cache')
+        self.assert404(status)
+
+    def test_search_rejects_collection_scans(self):
+        material, _ = self.post('/materials', data=valid_material_params())
+        self.post('/materials', data=valid_material_params())
+        self.app.config['SEARCH_COLLSCAN_LIMIT'] = 1
+
+        # hmdmc_set_by has no index
+        r, status = self.post('/materials/search', data={'where': {'hmdmc_set_by': 'a@b.c'}})
+        self.assert400(status)
+
+        r, status = self.post('/materials/search', data={'where': {'gender': 'female'}})
+        self.assert200(status)
+        self.assertEqual(r['_meta']['total'], 2)
+
+        r, status = self.post('/materials/search', data={'where': {'_id': material['_id']}})
+        self.assert200(status)
+        self.assertEqual(r['_meta']['total'], 1)
+
+    def test_material_facets(self):
+        self.post('/materials', data=valid_material_params())
+        self.post('/materials', data=valid_material_params())
+        self.post('/materials', data=utils.merge_dict(valid_material_params(), {'gender': 'male'}))
+
+        r, status = self.post('/materials/facets', data={'where': {'tissue_type': 'Blood'},
+                                                         'fields': ['gender', 'is_tumour']})
+        self.assert200(status)
+        self.assertEqual(r['gender'], [{'value': 'female', 'count': 2}, {'value': 'male', 'count': 1}])
+        self.assertEqual(r['is_tumour'], [{'value': 'normal', 'count': 3}])
+
+        r, status = self.post('/materials/facets', data={'where': {}, 'fields': ['gender'], 'max_values': 1})
+        self.assertEqual(r['gender'], [{'value': 'female', 'count': 2}])
+
+    def test_material_facets_of_fields_that_are_not_searchable(self):
+        r, status = self.post('/materials/facets', data={'where': {}, 'fields': ['hmdmc_set_by']})
+        self.assert400(status)
+        r, status = self.post('/materials/facets', data={'where': {}})
+        self.assert422(status)
+
+    def test_set_results_projection(self):
+        data = utils.merge_dict(valid_material_params(), {'meta': {'big': 'blob'}})
+        self.post('/materials', data=data)
+
+        r, status = self.post('/materials/search', data={'where': {}, 'projection': 'set_results'})
+        self.assert200(status)
+        item = r['_items'][0]
+        self.assertEqual(item['supplier_name'], data['supplier_name'])
+        self.assertNotIn('meta', item)
+        self.assertNotIn('hmdmc_set_by', item)
+
+        r, status = self.get('materials', '?projection=set_results')
+        self.assert200(status)
+        item = r['_items'][0]
+        self.assertEqual(item['supplier_name'], data['supplier_name'])
+        self.assertNotIn('meta', item)
+
+        r, status = self.post('/materials/search', data={'where': {}, 'projection': 'nonsense'})
+        self.assert400(status)
+
     def test_searchable_fields(self):
         response, status = self.get('materials/json_schema')
         self.assert200(status)
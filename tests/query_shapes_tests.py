@@ -0,0 +1,74 @@
+import unittest
+
+from query_shapes import (explain_command, filter_shape, recommend_index, index_covers, is_collection_scan,
+                          QueryShapeRecorder)
+
+
+class QueryShapeTests(unittest.TestCase):
+
+    def test_filter_shape_ignores_values(self):
+        where = {'owner_id': 'a', 'available': True,
+                 '$and': [{'date_of_receipt': {'$gte': 1}}, {'date_of_receipt': {'$lt': 2}}]}
+        self.assertEqual(filter_shape(where), (('available', ('$eq',)), ('date_of_receipt', ('$gte', '$lt')),
+                                               ('owner_id', ('$eq',))))
+        self.assertEqual(filter_shape(where), filter_shape({'available': False, 'owner_id': 'b',
+                                                            'date_of_receipt': {'$lt': 5, '$gte': 0}}))
+
+    def test_recommend_index_orders_equality_sort_range(self):
+        shape = filter_shape({'owner_id': 'a', 'tissue_type': {'$in': ['DNA']},
+                              'date_of_receipt': {'$gte': 1}})
+        self.assertEqual(recommend_index(shape, [('supplier_name', -1), ('_id', -1)]), [
+            ('owner_id', 1), ('tissue_type', 1), ('supplier_name', -1), ('_id', -1), ('date_of_receipt', 1)])
+
+    def test_recommend_index_for_unindexable_shapes(self):
+        self.assertIsNone(recommend_index(filter_shape({'$or': [{'a': 1}, {'b': 2}]}), None))
+        self.assertIsNone(recommend_index(filter_shape({}), None))
+
+    def test_explain_command_only_plans_the_query(self):
+        command = explain_command('materials', {'gender': 'male'}, [('donor_id', 1), ('_id', 1)], 10)
+        self.assertEqual(command.keys(), ['explain', 'verbosity'])
+        self.assertEqual(command['verbosity'], 'queryPlanner')
+        self.assertEqual(command['explain'].items(), [
+            ('find', 'materials'), ('filter', {'gender': 'male'}),
+            ('sort', {'donor_id': 1, '_id': 1}), ('limit', 10)])
+        self.assertEqual(command['explain']['sort'].keys(), ['donor_id', '_id'])
+        self.assertEqual(explain_command('materials', None)['explain'].items(),
+                         [('find', 'materials'), ('filter', {})])
+
+    def test_is_collection_scan(self):
+        def explanation(plan):
+            return {'queryPlanner': {'winningPlan': plan}}
+        self.assertTrue(is_collection_scan(explanation({'stage': 'COLLSCAN'})))
+        self.assertTrue(is_collection_scan(explanation(
+            {'stage': 'LIMIT', 'inputStage': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}})))
+        self.assertTrue(is_collection_scan(explanation(
+            {'stage': 'SUBPLAN', 'inputStage': {'stage': 'OR', 'inputStages': [
+                {'stage': 'IXSCAN'}, {'stage': 'COLLSCAN'}]}})))
+        self.assertFalse(is_collection_scan(explanation({'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}})))
+
+    def test_index_covers(self):
+        self.assertTrue(index_covers([('a', 1), ('b', -1), ('c', 1)], [('a', 1), ('b', -1)]))
+        self.assertTrue(index_covers([('a', 1), ('b', -1)], [('a', -1), ('b', 1)]))
+        self.assertFalse(index_covers([('a', 1), ('b', 1)], [('a', 1), ('b', -1)]))
+        self.assertFalse(index_covers([('a', 1)], [('a', 1), ('b', 1)]))
+
+    def test_recorder_report(self):
+        recorder = QueryShapeRecorder()
+        recorder.record({'owner_id': 'a'}, None, 0.002)
+        recorder.record({'owner_id': 'b'}, None, 0.004)
+        recorder.record({'gender': 'male'}, [('donor_id', 1)], 0.001)
+        report = recorder.report([[('owner_id', 1)]])
+        self.assertEqual(len(report), 2)
+        self.assertEqual(report[0]['filter'], {'owner_id': ['$eq']})
+        self.assertEqual(report[0]['count'], 2)
+        self.assertAlmostEqual(report[0]['mean_ms'], 3.0)
+        self.assertAlmostEqual(report[0]['max_ms'], 4.0)
+        self.assertTrue(report[0]['index_exists'])
+        self.assertEqual(report[1]['index'], [['gender', 1], ['donor_id', 1]])
+        self.assertFalse(report[1]['index_exists'])
+
+    def test_recorder_is_bounded(self):
+        recorder = QueryShapeRecorder(max_shapes=1)
+        recorder.record({'a': 1}, None, 0.001)
+        recorder.record({'b': 1}, None, 0.001)
+        self.assertEqual(len(recorder.report()), 1)
@@ -0,0 +1,54 @@
+import unittest
+
+from result_cache import ResultCache
+
+
+class ResultCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(max_entries=2, ttl=30)
+
+    def _get(self, resource, key):
+        return self.cache.get(resource, key, self.cache.generation(resource))
+
+    def _put(self, resource, key, value):
+        self.cache.put(resource, key, value, self.cache.generation(resource))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self._get('materials', 'a'))
+        self._put('materials', 'a', '{}')
+        self.assertEqual(self._get('materials', 'a'), '{}')
+        self.assertIsNone(self._get('containers', 'a'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        self._put('materials', 'a', 'A')
+        self._put('materials', 'b', 'B')
+        self._get('materials', 'a')
+        self._put('materials', 'c', 'C')
+        self.assertEqual(self._get('materials', 'a'), 'A')
+        self.assertIsNone(self._get('materials', 'b'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate_resource(self):
+        self._put('materials', 'a', 'A')
+        self._put('containers', 'a', 'C')
+        self.cache.invalidate('materials')
+        self.assertIsNone(self._get('materials', 'a'))
+        self.assertEqual(self._get('containers', 'a'), 'C')
+
+    def test_result_of_query_begun_before_invalidation_is_not_returned(self):
+        generation = self.cache.generation('materials')
+        self.cache.invalidate('materials')
+        self.cache.put('materials', 'a', 'A', generation)
+        self.assertIsNone(self._get('materials', 'a'))
+
+    def test_expiry(self):
+        self.cache.ttl = 0
+        self._put('materials', 'a', 'A')
+        self.assertIsNone(self._get('materials', 'a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
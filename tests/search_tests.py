@@ -0,0 +1,130 @@
+import unittest
+from datetime import datetime
+
+from search import (decode_cursor, encode_cursor, include_fields, keyset_filter, convert_dates,
+                    facet_pipeline, pop_field, projection_profiles, searchable_fields, WhereNormaliser)
+from schema import material_schema
+
+
+class CursorTests(unittest.TestCase):
+
+    def test_cursor_round_trip(self):
+        item = {'_id': 'abc', 'date_of_receipt': datetime(2018, 3, 4, 5, 6, 7), 'gender': 'male'}
+        value, _id = decode_cursor(encode_cursor(item, 'date_of_receipt'))
+        self.assertEqual(_id, 'abc')
+        self.assertEqual(value.replace(tzinfo=None), item['date_of_receipt'])
+        self.assertEqual(decode_cursor(encode_cursor(item, None)), (None, 'abc'))
+
+    def test_cursor_with_dotted_sort(self):
+        item = {'_id': 'abc', 'meta': {'x': 5}}
+        self.assertEqual(decode_cursor(encode_cursor(item, 'meta.x')), (5, 'abc'))
+        self.assertEqual(decode_cursor(encode_cursor(item, 'meta.y.z')), (None, 'abc'))
+
+    def test_pop_field(self):
+        item = {'_id': 'abc', 'meta': {'x': 5, 'y': {'z': 6}}}
+        pop_field(item, 'meta.y.z')
+        self.assertEqual(item, {'_id': 'abc', 'meta': {'x': 5}})
+        pop_field(item, 'meta.x')
+        self.assertEqual(item, {'_id': 'abc'})
+        pop_field(item, '_id')
+        pop_field(item, 'gender.x')
+        self.assertEqual(item, {})
+
+    def test_invalid_cursor(self):
+        self.assertRaises(ValueError, decode_cursor, 'not a cursor')
+        self.assertRaises(ValueError, decode_cursor, encode_cursor({'_id': 1}, None)[:-3])
+
+    def test_keyset_filter_without_sort(self):
+        self.assertEqual(keyset_filter(None, 1, None, 'abc'), {'_id': {'$gt': 'abc'}})
+        self.assertEqual(keyset_filter(None, -1, None, 'abc'), {'_id': {'$lt': 'abc'}})
+
+    def test_keyset_filter_with_sort(self):
+        self.assertEqual(keyset_filter('gender', 1, 'male', 'abc'), {'$or': [
+            {'gender': {'$gt': 'male'}}, {'gender': 'male', '_id': {'$gt': 'abc'}}]})
+        self.assertEqual(keyset_filter('gender', -1, 'male', 'abc'), {'$or': [
+            {'gender': {'$lt': 'male'}}, {'gender': 'male', '_id': {'$lt': 'abc'}}, {'gender': None}]})
+
+    def test_keyset_filter_after_null(self):
+        self.assertEqual(keyset_filter('gender', 1, None, 'abc'), {'$or': [
+            {'gender': None, '_id': {'$gt': 'abc'}}, {'gender': {'$ne': None}}]})
+        self.assertEqual(keyset_filter('gender', -1, None, 'abc'), {'gender': None, '_id': {'$lt': 'abc'}})
+
+
+class IncludeFieldsTests(unittest.TestCase):
+
+    def test_no_projection(self):
+        self.assertEqual(include_fields(None, ['_id', 'gender']), (None, []))
+
+    def test_inclusive_projection(self):
+        self.assertEqual(include_fields({'donor_id': 1, '_id': 0}, ['_id', 'gender']),
+                         ({'donor_id': 1, 'gender': 1}, ['_id', 'gender']))
+        self.assertEqual(include_fields(['gender'], ['_id', 'gender']), ({'gender': 1}, []))
+
+    def test_exclusive_projection(self):
+        self.assertEqual(include_fields({'meta': 0, 'gender': 0}, ['_id', 'gender']),
+                         ({'meta': 0}, ['gender']))
+
+
+class WhereNormaliserTests(unittest.TestCase):
+
+    def test_converts_dates_of_datetime_fields(self):
+        where = {'$and': [{'date_of_receipt': {'$gte': 'Thu, 01 Mar 2018 00:00:00 GMT'}},
+                          {'donor_id': 'Thu, 01 Mar 2018 00:00:00 GMT'}]}
+        converted = WhereNormaliser(material_schema)(where)
+        self.assertEqual(converted['$and'][0]['date_of_receipt']['$gte'], datetime(2018, 3, 1))
+        self.assertEqual(converted['$and'][1]['donor_id'], 'Thu, 01 Mar 2018 00:00:00 GMT')
+
+    def test_does_not_change_the_given_filter(self):
+        where = {'date_of_receipt': 'Thu, 01 Mar 2018 00:00:00 GMT'}
+        WhereNormaliser(material_schema)(where)
+        self.assertEqual(where, {'date_of_receipt': 'Thu, 01 Mar 2018 00:00:00 GMT'})
+
+    def test_leaves_unparseable_dates(self):
+        self.assertEqual(convert_dates({'d': ['soon']}, {'d'}), {'d': ['soon']})
+
+    def test_reuses_prepared_filters(self):
+        normaliser = WhereNormaliser(material_schema, cache_size=2)
+        first = normaliser({'owner_id': 'a', 'available': True})
+        self.assertIs(normaliser({'available': True, 'owner_id': 'a'}), first)
+        normaliser({'owner_id': 'b'})
+        normaliser({'owner_id': 'c'})
+        self.assertIsNot(normaliser({'owner_id': 'a', 'available': True}), first)
+        self.assertEqual(normaliser({'owner_id': 'a', 'available': True}), first)
+
+
+class ProjectionProfilesTests(unittest.TestCase):
+
+    def test_profiles_from_show_on_flags(self):
+        schema = {'a': {'show_on_set_results': True, 'show_on_form': True},
+                  'b': {'show_on_set_results': True, 'show_on_form': False},
+                  'c': {'type': 'string'}}
+        self.assertEqual(projection_profiles(schema), {'set_results': {'a': 1, 'b': 1}, 'form': {'a': 1}})
+
+    def test_material_set_results_profile(self):
+        profile = projection_profiles(material_schema)['set_results']
+        self.assertIn('supplier_name', profile)
+        self.assertNotIn('meta', profile)
+
+
+class FacetTests(unittest.TestCase):
+
+    def test_searchable_fields(self):
+        fields = searchable_fields(material_schema)
+        self.assertIn('gender', fields)
+        self.assertNotIn('hmdmc_set_by', fields)
+
+    def test_facet_pipeline(self):
+        pipeline = facet_pipeline({'available': True}, ['gender', 'tissue_type'], max_values=5)
+        self.assertEqual(pipeline[0], {'$match': {'available': True}})
+        self.assertEqual(sorted(pipeline[1]['$facet']), ['gender', 'tissue_type'])
+        self.assertEqual(pipeline[1]['$facet']['gender'], [
+            {'$group': {'_id': '$gender', 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': 5}])
+        # Most common first, then by value
+        self.assertEqual(pipeline[1]['$facet']['gender'][1]['$sort'].keys(), ['count', '_id'])
+
+    def test_facet_pipeline_without_filter(self):
+        pipeline = facet_pipeline(None, ['gender'])
+        self.assertEqual(pipeline[0], {'$match': {}})
+        self.assertEqual(len(pipeline[1]['$facet']['gender']), 2)
@@ -0,0 +1,38 @@
+import json
+import unittest
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+
+from serialization import make_dumps
+
+DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+
+class SerializationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dumps = make_dumps(DATE_FORMAT)
+
+    def test_formats_dates_at_any_depth(self):
+        date = datetime(2017, 3, 4, 5, 6, 7)
+        result = json.loads(self.dumps({'_items': [{'_created': date, 'meta': {'seen': [date]}}]}))
+        self.assertEqual(result, {'_items': [{'_created': 'Sat, 04 Mar 2017 05:06:07 GMT',
+                                              'meta': {'seen': ['Sat, 04 Mar 2017 05:06:07 GMT']}}]})
+
+    def test_uuids_and_bson_types(self):
+        uid = uuid.uuid4()
+        oid = ObjectId()
+        self.assertEqual(json.loads(self.dumps({'a': uid, 'b': oid})),
+                         {'a': str(uid), 'b': {'$oid': str(oid)}})
+
+    def test_unicode(self):
+        self.assertEqual(json.loads(self.dumps({u'name': u'caf\xe9'})), {'name': u'caf\xe9'})
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, make_dumps, DATE_FORMAT, 'nonexistent')
+
+
+if __name__ == '__main__':
+    unittest.main()
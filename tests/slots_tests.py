@@ -0,0 +1,42 @@
+import unittest
+
+from slots import fill_empty_slots, remove_empty_slots
+
+
+class SlotsTests(unittest.TestCase):
+    def _container(self, slots=None):
+        container = {'num_of_rows': 2, 'num_of_cols': 2, 'row_is_alpha': True, 'col_is_alpha': False}
+        if slots is not None:
+            container['slots'] = slots
+        return container
+
+    def test_fill_empty_slots_without_slots(self):
+        container = self._container()
+        fill_empty_slots(container)
+        self.assertEqual(container['slots'], [{'address': a} for a in 'A:1 A:2 B:1 B:2'.split()])
+
+    def test_fill_empty_slots_in_address_order(self):
+        container = self._container([{'address': 'B:1', 'material': 'x'}, {'address': 'A:2', 'material': 'y'}])
+        fill_empty_slots(container)
+        self.assertEqual(container['slots'], [{'address': 'A:1'}, {'address': 'A:2', 'material': 'y'},
+                                              {'address': 'B:1', 'material': 'x'}, {'address': 'B:2'}])
+
+    def test_fill_empty_slots_keeps_slots_outside_geometry(self):
+        container = self._container([{'address': 'C:1', 'material': 'x'}])
+        fill_empty_slots(container)
+        self.assertEqual([s['address'] for s in container['slots']], 'A:1 A:2 B:1 B:2 C:1'.split())
+
+    def test_remove_empty_slots(self):
+        container = self._container([{'address': 'A:1'}, {'address': 'A:2', 'material': 'x'},
+                                     {'address': 'B:1', 'material': None}])
+        remove_empty_slots(container)
+        self.assertEqual(container['slots'], [{'address': 'A:2', 'material': 'x'}])
+
+    def test_fill_reverses_remove(self):
+        container = self._container()
+        fill_empty_slots(container)
+        container['slots'][1]['material'] = 'x'
+        expected = [dict(slot) for slot in container['slots']]
+        remove_empty_slots(container)
+        fill_empty_slots(container)
+        self.assertEqual(sorted(container['slots']), sorted(expected))